@@ -0,0 +1,132 @@
+import numpy as np
+
+
+class AccessAnalytics:
+    # Снимок таблицы permissions в массивах NumPy для отчётов по всей
+    # матрице. Хранится в разреженном виде (индекс субъекта, индекс объекта,
+    # маска прав); плотная матрица строится по запросу. Индексы соответствуют
+    # отсортированным спискам subjects и objects.
+    def __init__(self, db):
+        self.rights = dict(db.rights)
+        self.subjects = db.get_subjects()
+        self.objects = db.get_objects()
+        self._subject_index = {name: i for i, name in enumerate(self.subjects)}
+        self._object_index = {name: i for i, name in enumerate(self.objects)}
+        self.dtype = np.uint8 if max(self.rights.values()) < 1 << 8 else np.uint64
+
+        # id из базы переводятся в индексы через таблицы поиска; строки
+        # с неизвестными id (удалёнными сущностями) отбрасываются
+        subject_lookup = self._lookup(db.subject_id, self.subjects)
+        object_lookup = self._lookup(db.object_id, self.objects)
+        rows = np.array(list(db.iter_cell_ids()), dtype=np.int64).reshape(-1, 3)
+        subject_ids = np.clip(rows[:, 0], 0, len(subject_lookup) - 1)
+        object_ids = np.clip(rows[:, 1], 0, len(object_lookup) - 1)
+        subject_index = np.where(rows[:, 0] == subject_ids, subject_lookup[subject_ids], -1)
+        object_index = np.where(rows[:, 1] == object_ids, object_lookup[object_ids], -1)
+        known = (subject_index >= 0) & (object_index >= 0)
+
+        self.subject_index = subject_index[known]
+        self.object_index = object_index[known]
+        self.masks = rows[known, 2].astype(self.dtype)
+        self._dense = None
+
+    @staticmethod
+    def _lookup(to_id, names):
+        ids = [to_id(name) for name in names]
+        lookup = np.full(max(ids, default=0) + 1, -1, dtype=np.int64)
+        lookup[ids] = np.arange(len(ids))
+        return lookup
+
+    @property
+    def shape(self):
+        return len(self.subjects), len(self.objects)
+
+    def _mask(self, rights):
+        if isinstance(rights, str):
+            rights = [rights]
+        mask = 0
+        for right in rights:
+            if right not in self.rights:
+                raise ValueError(f"Неизвестное право {right}")
+            mask |= self.rights[right]
+        return self.dtype(mask)
+
+    def _select(self, rights, match='any'):
+        # Булев вектор по ненулевым ячейкам
+        mask = self._mask(rights)
+        if match == 'any':
+            return (self.masks & mask) != 0
+        if match == 'all':
+            return (self.masks & mask) == mask
+        raise ValueError(f"Неизвестный режим {match}")
+
+    def to_dense(self):
+        if self._dense is None:
+            dense = np.zeros(self.shape, dtype=self.dtype)
+            dense[self.subject_index, self.object_index] = self.masks
+            self._dense = dense
+        return self._dense
+
+    def to_sparse(self):
+        return self.subject_index, self.object_index, self.masks
+
+    def has(self, rights, match='any'):
+        dense = self.to_dense()
+        mask = self._mask(rights)
+        if match == 'all':
+            return (dense & mask) == mask
+        return (dense & mask) != 0
+
+    def subject_counts(self, rights, match='any'):
+        # Число объектов, на которые у каждого субъекта есть права
+        selected = self._select(rights, match)
+        return np.bincount(self.subject_index[selected], minlength=len(self.subjects))
+
+    def object_counts(self, rights, match='any'):
+        selected = self._select(rights, match)
+        return np.bincount(self.object_index[selected], minlength=len(self.objects))
+
+    def subjects_over(self, rights, threshold, match='any'):
+        counts = self.subject_counts(rights, match)
+        return [self.subjects[i] for i in np.flatnonzero(counts > threshold)]
+
+    def objects_without(self, right, holder='own'):
+        # Объекты, у которых ни один субъект с правом holder не имеет right
+        covered = self.object_counts([holder, right], match='all') > 0
+        return [self.objects[i] for i in np.flatnonzero(~covered)]
+
+    def cells(self, rights, match='any'):
+        selected = np.flatnonzero(self._select(rights, match))
+        return [
+            (self.subjects[s], self.objects[o])
+            for s, o in zip(self.subject_index[selected].tolist(), self.object_index[selected].tolist())
+        ]
+
+    def overlap(self, right='read', subjects=None, chunk_cells=1 << 24):
+        # Матрица пересечений: [i, j] - число объектов, на которые право right
+        # есть и у субъекта i, и у субъекта j. Участвуют только объекты с
+        # этим правом у выбранных субъектов; матрица инцидентности строится
+        # блоками по столбцам не больше chunk_cells ячеек, и произведения
+        # блоков складываются.
+        names = list(subjects) if subjects is not None else list(self.subjects)
+        rows = np.array([self._subject_index[name] for name in names], dtype=np.int64)
+        position = np.full(len(self.subjects), -1, dtype=np.int64)
+        position[rows] = np.arange(len(rows))
+
+        selected = self._select(right) & (position[self.subject_index] >= 0)
+        cell_rows = position[self.subject_index[selected]]
+        active, columns = np.unique(self.object_index[selected], return_inverse=True)
+        order = np.argsort(columns, kind='stable')
+        cell_rows, columns = cell_rows[order], columns[order]
+
+        result = np.zeros((len(rows), len(rows)), dtype=np.int64)
+        width = max(1, chunk_cells // max(len(rows), 1))
+        for start in range(0, len(active), width):
+            stop = min(start + width, len(active))
+            lo, hi = np.searchsorted(columns, [start, stop])
+            block = np.zeros((len(rows), stop - start), dtype=np.uint8)
+            block[cell_rows[lo:hi], columns[lo:hi] - start] = 1
+            # float32 только для блока: BLAS и точный счёт до 2**24
+            block = block.astype(np.float32)
+            result += (block @ block.T).astype(np.int64)
+        return names, result
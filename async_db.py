@@ -0,0 +1,110 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from model import BATCH_COMMANDS, RESET_EVENTS, HRUDatabase
+
+READ_METHODS = (
+    'check', 'check_by_id',
+    'get_rights', 'get_rights_by_id', 'get_rights_page',
+    'get_subjects', 'get_objects', 'search_subjects', 'search_objects',
+    'subjects_with_rights', 'objects_with_rights',
+    'schema_version',
+)
+
+WRITE_METHODS = BATCH_COMMANDS + (
+    'delete_subject_by_id', 'create_object_by_id', 'delete_object_by_id',
+    'grant_right_by_id', 'revoke_right_by_id',
+    'delete_subjects', 'delete_objects',
+    'apply', 'register_right',
+)
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class AsyncHRUDatabase:
+    # Асинхронный фасад над HRUDatabase. Чтения выполняются в отдельном пуле
+    # потоков (каждый берёт соединение из пула читателей), записи - в одном
+    # потоке писателя, поэтому проверки не ждут в очереди за записями.
+    # Одновременные одинаковые чтения объединяются в один вызов; его
+    # результат получают все ожидающие, поэтому изменять его не следует.
+    # Поколение записей входит в ключ: чтение после завершившейся записи не
+    # присоединяется к чтению, начатому до неё.
+    def __init__(self, db=None, read_workers=4, **kwargs):
+        self._owns_db = db is None
+        self.db = db if db is not None else HRUDatabase(**kwargs)
+        self._read_executor = ThreadPoolExecutor(
+            max_workers=read_workers,
+            thread_name_prefix='hru-read',
+        )
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hru-write')
+        self._inflight = {}
+        self.coalesced = 0
+        self._generation = 0
+        self.db.add_listener(self._on_event, cells=False)
+
+    def _on_event(self, event, *args):
+        # Вызывается в потоке писателя до того, как запись вернёт результат
+        if event == 'commit' or event in RESET_EVENTS:
+            self._generation += 1
+
+    async def _read(self, name, *args, **kwargs):
+        key = (self._generation, name, _freeze(args), _freeze(sorted(kwargs.items())))
+        future = self._inflight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self._read_executor, functools.partial(getattr(self.db, name), *args, **kwargs)
+            )
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+    async def _write(self, name, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._write_executor, functools.partial(getattr(self.db, name), *args, **kwargs)
+        )
+
+    async def check_many(self, queries):
+        return await asyncio.gather(*(self.check(*query) for query in queries))
+
+    async def close(self):
+        # shutdown(wait=True) блокирует, поэтому выполняется вне цикла событий
+        self.db.remove_listener(self._on_event)
+        await asyncio.to_thread(self._read_executor.shutdown, wait=True)
+        await asyncio.to_thread(self._write_executor.shutdown, wait=True)
+        if self._owns_db:
+            self.db.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+def _read_method(name):
+    async def method(self, *args, **kwargs):
+        return await self._read(name, *args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+def _write_method(name):
+    async def method(self, *args, **kwargs):
+        return await self._write(name, *args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+for _name in READ_METHODS:
+    setattr(AsyncHRUDatabase, _name, _read_method(_name))
+for _name in WRITE_METHODS:
+    setattr(AsyncHRUDatabase, _name, _write_method(_name))
@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from model import HRUDatabase, SCHEMA_VERSION
+from server import percentile
+
+DEFAULT_MIX = {'check': 0.7, 'grant': 0.15, 'revoke': 0.1, 'delete': 0.05}
+
+
+class Workload:
+    # Синтетическая матрица доступа заданной формы: subjects x objects,
+    # доля density непустых ячеек; владельцы объектов выбираются случайно
+    def __init__(self, db, subjects=100, objects=1000, density=0.01, seed=0):
+        self.db = db
+        self.random = random.Random(seed)
+        self.subjects = [f"s{i:06d}" for i in range(subjects)]
+        self.objects = [f"o{i:06d}" for i in range(objects)]
+        self.owners = {}
+        self.density = density
+        self.created = 0
+
+    def populate(self):
+        rights = [right for right in self.db.rights if right != 'own']
+        db, rnd = self.db, self.random
+        with db.transaction():
+            db.apply([('create_subject', name) for name in self.subjects])
+            for name in self.objects:
+                owner = rnd.choice(self.subjects)
+                db.create_object(name, owner)
+                self.owners[name] = owner
+
+            total = len(self.subjects) * len(self.objects)
+            for cell in rnd.sample(range(total), int(total * self.density)):
+                subject = self.subjects[cell // len(self.objects)]
+                obj = self.objects[cell % len(self.objects)]
+                granted = rnd.sample(rights, rnd.randint(1, len(rights)))
+                db.grant_right(self.owners[obj], subject, obj, granted)
+
+    def _new_object(self):
+        self.created += 1
+        name = f"n{self.created:06d}"
+        owner = self.random.choice(self.subjects)
+        self.db.create_object(name, owner)
+        self.owners[name] = owner
+        self.objects.append(name)
+
+    def step(self, operation):
+        # Возвращает вызываемую операцию; подготовка не входит в замер
+        db, rnd = self.db, self.random
+        subject = rnd.choice(self.subjects)
+        index = rnd.randrange(len(self.objects))
+        obj = self.objects[index]
+        right = rnd.choice(list(db.rights))
+
+        if operation == 'check':
+            return lambda: db.check(subject, obj, right)
+        if operation == 'grant':
+            return lambda: db.grant_right(self.owners[obj], subject, obj, right)
+        if operation == 'revoke':
+            return lambda: db.revoke_right(self.owners[obj], subject, obj, right)
+        if operation == 'delete':
+            # Удалённый объект заменяется новым, чтобы размер матрицы не менялся
+            self.objects[index] = self.objects[-1]
+            self.objects.pop()
+            self._new_object()
+            return lambda: db.delete_object(obj, self.owners.pop(obj))
+        raise ValueError(f"Неизвестная операция {operation}")
+
+
+def run_benchmark(db, subjects=100, objects=1000, density=0.01, operations=10000, mix=None, seed=0):
+    mix = mix or DEFAULT_MIX
+    workload = Workload(db, subjects, objects, density, seed)
+
+    started = time.perf_counter()
+    workload.populate()
+    setup = time.perf_counter() - started
+
+    names = list(mix)
+    plan = workload.random.choices(names, weights=[mix[name] for name in names], k=operations)
+    samples = {name: [] for name in names}
+    started = time.perf_counter()
+    for name in plan:
+        call = workload.step(name)
+        began = time.perf_counter()
+        call()
+        samples[name].append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    for name, values in samples.items():
+        values.sort()
+        busy = sum(values)
+        report[name] = {
+            'count': len(values),
+            'ops_per_second': len(values) / busy if busy else 0.0,
+            'p50_ms': percentile(values, 50) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+        }
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'schema_version': SCHEMA_VERSION,
+        },
+        'shape': {
+            'subjects': subjects,
+            'objects': objects,
+            'rights': len(db.rights),
+            'density': density,
+            'seed': seed,
+        },
+        'setup_seconds': setup,
+        'operations': report,
+        'total': {
+            'count': operations,
+            'seconds': elapsed,
+            'ops_per_second': operations / elapsed if elapsed else 0.0,
+        },
+    }
+
+
+def _mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"неизвестная операция {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест HRU модели")
+    parser.add_argument('--db', help="путь к базе данных (по умолчанию временный файл)")
+    parser.add_argument('--subjects', type=int, default=100)
+    parser.add_argument('--objects', type=int, default=1000)
+    parser.add_argument('--density', type=float, default=0.01, help="доля непустых ячеек матрицы")
+    parser.add_argument('--operations', type=int, default=10000)
+    parser.add_argument('--mix', type=_mix, default=DEFAULT_MIX,
+                        help="веса операций, например check=0.7,grant=0.2,revoke=0.1")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="файл для JSON-отчёта (по умолчанию stdout)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.db or os.path.join(directory, 'bench.db')
+        db = HRUDatabase(path)
+        try:
+            report = run_benchmark(db, args.subjects, args.objects, args.density,
+                                   args.operations, args.mix, args.seed)
+        finally:
+            db.close()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
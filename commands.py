@@ -0,0 +1,293 @@
+import re
+
+from model import RIGHTS
+
+OPERATIONS = (
+    'enter', 'delete',
+    'create_subject', 'create_object',
+    'destroy_subject', 'destroy_object',
+)
+
+
+class Condition:
+    # Условие HRU-команды: право right присутствует в ячейке (subject, obj)
+    def __init__(self, right, subject, obj):
+        self.right = right
+        self.subject = subject
+        self.obj = obj
+
+    def __repr__(self):
+        return f"{self.right} in ({self.subject}, {self.obj})"
+
+
+class Operation:
+    def __init__(self, kind, right=None, subject=None, obj=None):
+        if kind not in OPERATIONS:
+            raise ValueError(f"Неизвестная примитивная операция {kind}")
+        self.kind = kind
+        self.right = right
+        self.subject = subject
+        self.obj = obj
+
+    @property
+    def params(self):
+        return [param for param in (self.subject, self.obj) if param is not None]
+
+    def __repr__(self):
+        if self.kind == 'enter':
+            return f"enter {self.right} into ({self.subject}, {self.obj})"
+        if self.kind == 'delete':
+            return f"delete {self.right} from ({self.subject}, {self.obj})"
+        return f"{self.kind.replace('_', ' ')} {self.subject or self.obj}"
+
+
+def enter(right, subject, obj):
+    return Operation('enter', right, subject, obj)
+
+
+def delete(right, subject, obj):
+    return Operation('delete', right, subject, obj)
+
+
+def create_subject(subject):
+    return Operation('create_subject', subject=subject)
+
+
+def create_object(obj):
+    return Operation('create_object', obj=obj)
+
+
+def destroy_subject(subject):
+    return Operation('destroy_subject', subject=subject)
+
+
+def destroy_object(obj):
+    return Operation('destroy_object', obj=obj)
+
+
+class Command:
+    # HRU-команда: if <conditions> then <operations>. Параметры, которые
+    # создаются самой командой (create subject/object), не перебираются
+    # при анализе, а получают новое имя.
+    def __init__(self, name, params, conditions, operations):
+        self.name = name
+        self.params = tuple(params)
+        self.conditions = tuple(conditions)
+        self.operations = tuple(operations)
+
+        self.kinds = {}
+        for item in self.conditions + self.operations:
+            if item.subject is not None:
+                self._set_kind(item.subject, 'subject')
+            if item.obj is not None:
+                self._set_kind(item.obj, 'object')
+        unknown = [param for param in self.kinds if param not in self.params]
+        if unknown:
+            raise ValueError(f"Команда {name}: неизвестные параметры {', '.join(unknown)}")
+
+        self.created = frozenset(
+            op.subject or op.obj for op in self.operations
+            if op.kind in ('create_subject', 'create_object')
+        )
+
+    def _set_kind(self, param, kind):
+        if self.kinds.setdefault(param, kind) != kind:
+            raise ValueError(f"Команда {self.name}: параметр {param} используется и как субъект, и как объект")
+
+    @property
+    def monotonic(self):
+        return all(op.kind not in ('delete', 'destroy_subject', 'destroy_object') for op in self.operations)
+
+    @property
+    def removes_only(self):
+        return all(op.kind in ('delete', 'destroy_subject', 'destroy_object') for op in self.operations)
+
+    def __repr__(self):
+        conditions = ' and '.join(map(repr, self.conditions))
+        operations = '; '.join(map(repr, self.operations))
+        head = f"command {self.name}({', '.join(self.params)})"
+        if conditions:
+            return f"{head}: if {conditions} then {operations}"
+        return f"{head}: {operations}"
+
+
+def default_commands(rights=None):
+    # Команды, соответствующие примитивам HRUDatabase
+    rights = list(rights or RIGHTS)
+    commands = [
+        Command('create_subject', ['s'], [], [create_subject('s')]),
+        Command('create_object', ['s', 'o'], [], [
+            create_object('o'),
+            *[enter(right, 's', 'o') for right in rights],
+        ]),
+        Command('delete_object', ['s', 'o'], [Condition('own', 's', 'o')], [destroy_object('o')]),
+    ]
+    for right in rights:
+        commands.append(Command(
+            f'grant_{right}', ['s1', 's2', 'o'],
+            [Condition('own', 's1', 'o')],
+            [enter(right, 's2', 'o')],
+        ))
+        commands.append(Command(
+            f'revoke_{right}', ['s1', 's2', 'o'],
+            [Condition('own', 's1', 'o')],
+            [delete(right, 's2', 'o')],
+        ))
+    return commands
+
+
+# Разбор текстового определения команд. Синтаксис совпадает с repr(Command):
+#   command grant_read(s1, s2, o): if own in (s1, o) then enter read into (s2, o)
+# Условия разделяются "and", операции - ";"; команда может занимать
+# несколько строк, # - комментарий до конца строки.
+_HEAD = re.compile(r'command\s+(\w+)\s*\(([^)]*)\)\s*:\s*(.*)', re.S)
+_CONDITION = re.compile(r'(\w+)\s+in\s+\(\s*(\w+)\s*,\s*(\w+)\s*\)')
+_CELL_OPERATION = re.compile(r'(enter|delete)\s+(\w+)\s+(?:into|from)\s+\(\s*(\w+)\s*,\s*(\w+)\s*\)')
+_ENTITY_OPERATION = re.compile(r'(create|destroy)\s+(subject|object)\s+(\w+)')
+
+
+def _parse_operation(text):
+    match = _CELL_OPERATION.fullmatch(text)
+    if match:
+        kind, right, subject, obj = match.groups()
+        if (kind == 'enter') != text.split()[2].startswith('into'):
+            raise ValueError(f"Некорректная операция: {text}")
+        return Operation(kind, right, subject, obj)
+    match = _ENTITY_OPERATION.fullmatch(text)
+    if match:
+        action, entity, param = match.groups()
+        if entity == 'subject':
+            return Operation(f'{action}_{entity}', subject=param)
+        return Operation(f'{action}_{entity}', obj=param)
+    raise ValueError(f"Некорректная операция: {text}")
+
+
+def parse_command(text):
+    match = _HEAD.fullmatch(' '.join(text.split()))
+    if not match:
+        raise ValueError(f"Некорректное определение команды: {text.strip()}")
+    name, params, body = match.groups()
+    params = [param.strip() for param in params.split(',') if param.strip()]
+
+    conditions = []
+    if body.startswith('if '):
+        head, separator, body = body[3:].partition(' then ')
+        if not separator:
+            raise ValueError(f"Команда {name}: нет then")
+        for part in head.split(' and '):
+            condition = _CONDITION.fullmatch(part.strip())
+            if not condition:
+                raise ValueError(f"Команда {name}: некорректное условие {part.strip()}")
+            conditions.append(Condition(*condition.groups()))
+    operations = [_parse_operation(part.strip()) for part in body.split(';') if part.strip()]
+    if not operations:
+        raise ValueError(f"Команда {name}: нет операций")
+    return Command(name, params, conditions, operations)
+
+
+def parse_commands(text):
+    lines = [line.split('#', 1)[0] for line in text.splitlines()]
+    chunks = re.split(r'(?m)^\s*(?=command\b)', '\n'.join(lines))
+    return [parse_command(chunk) for chunk in chunks if chunk.strip()]
+
+
+# SQL шагов плана; тексты постоянны, поэтому sqlite3 повторно использует
+# подготовленные выражения из кэша соединения
+PLAN_SQL = {
+    'create_subject': "INSERT INTO subjects (name) VALUES (?)",
+    'create_object': "INSERT INTO objects (name, owner_id) VALUES (?, ?)",
+    'enter': """INSERT INTO permissions (subject_id, object_id, rights) VALUES (?, ?, ?)
+                ON CONFLICT (subject_id, object_id) DO UPDATE SET rights = rights | excluded.rights""",
+    'delete': "UPDATE permissions SET rights = rights & ~? WHERE subject_id = ? AND object_id = ?",
+    'destroy_cells': "DELETE FROM permissions WHERE object_id = ?",
+    'destroy_object': "DELETE FROM objects WHERE id = ?",
+}
+CONDITION_SQL = "EXISTS (SELECT 1 FROM permissions WHERE subject_id = ? AND object_id = ? AND rights & ? = ?)"
+
+
+class CommandPlan:
+    # Скомпилированная команда: условия проверяются одним SELECT, операции
+    # заранее сгруппированы по ячейкам. Выполняется HRUDatabase.run_command
+    # в одной транзакции.
+    def __init__(self, command, db):
+        self.command = command
+        self.name = command.name
+        self.params = command.params
+        self.kinds = command.kinds
+        self.created = command.created
+        self.source = repr(command)
+        self.sql = PLAN_SQL
+        self.db = db
+
+        cells = {}
+        for condition in command.conditions:
+            if condition.subject in command.created or condition.obj in command.created:
+                raise ValueError(f"Команда {self.name}: условие на создаваемую сущность")
+            key = (condition.subject, condition.obj)
+            cells[key] = cells.get(key, 0) | self._mask(condition.right)
+        self.conditions = list(cells.items())
+        self.condition_sql = ("SELECT " + " AND ".join([CONDITION_SQL] * len(self.conditions))
+                              if self.conditions else None)
+
+        # Создаваемые субъекты новые, и до создания на них ничто не ссылается,
+        # поэтому их создание переносится в начало: владелец create object
+        # может быть объявлен в команде позже объекта
+        operations = sorted(command.operations, key=lambda op: op.kind != 'create_subject')
+        created = set()
+        for op in operations:
+            used = {name for name in (op.subject, op.obj) if name in command.created}
+            if op.kind.startswith('create'):
+                created |= used
+            if op.kind == 'create_object' and self._owner(op.obj) in command.created - created:
+                used.add(self._owner(op.obj))
+            if used - created:
+                raise ValueError(
+                    f"Команда {self.name}: {', '.join(sorted(used - created))} используется до создания"
+                )
+
+        self.steps = []
+        for op in operations:
+            if op.kind in ('enter', 'delete'):
+                mask = self._mask(op.right)
+                last = self.steps[-1] if self.steps else None
+                if last and last[0] == op.kind and last[1:3] == (op.subject, op.obj):
+                    self.steps[-1] = (op.kind, op.subject, op.obj, last[3] | mask)
+                else:
+                    self.steps.append((op.kind, op.subject, op.obj, mask))
+            elif op.kind == 'create_object':
+                self.steps.append((op.kind, op.obj, self._owner(op.obj)))
+            else:
+                self.steps.append((op.kind, op.subject or op.obj))
+
+    def _mask(self, right):
+        mask = self.db.rights_mask(right)
+        if mask is None:
+            raise ValueError(f"Команда {self.name}: неизвестное право {right}")
+        return mask
+
+    def _owner(self, obj):
+        # Владелец создаваемого объекта - субъект первой операции enter own
+        # в ячейку (s, obj), иначе первой любой enter в эту ячейку
+        cells = sorted(
+            (op for op in self.command.operations if op.kind == 'enter' and op.obj == obj),
+            key=lambda op: op.right != 'own'
+        )
+        if not cells:
+            raise ValueError(f"Команда {self.name}: для create object {obj} нужна операция enter в ячейку с {obj}")
+        return cells[0].subject
+
+    def __call__(self, *args):
+        return self.db.run_command(self, *args)
+
+    def __repr__(self):
+        return f"CommandPlan({self.source})"
+
+
+def compile_command(command, db):
+    if isinstance(command, str):
+        command = parse_command(command)
+    return CommandPlan(command, db)
+
+
+def compile_commands(text, db):
+    return {command.name: CommandPlan(command, db) for command in parse_commands(text)}
@@ -0,0 +1,222 @@
+from matrix import _bits
+from model import RESET_EVENTS
+
+
+class GrantGraph:
+    # Граф уже выданных прав между субъектами. Ребро A -> B есть, если A
+    # владеет (own) каким-либо объектом, на который у B есть права, то есть
+    # A уже поделился с B. Достижимость по рёбрам - цепочки существующих
+    # передач: кого затронет доступ, распространяющийся от субъекта или от
+    # владельцев объекта по уже установленным связям.
+    #
+    # Это не вопрос о том, может ли субъект получить право: grant_right
+    # позволяет любому владельцу передать любое право любому субъекту, так
+    # что права на объект с владельцем может получить каждый. Для анализа
+    # с произвольными командами есть safety.SafetyAnalyzer.
+    #
+    # Транзитивное замыкание хранится битовыми множествами: reach[x] - кого
+    # достигает x (включая x), back[y] - кто достигает y. Добавление ребра
+    # дополняет замыкание только у предков его начала; удаление пересчитывает
+    # достижимость лишь у тех, кто достигал начала удалённого ребра.
+    def __init__(self, db):
+        self.db = db
+        self.reload()
+        db.add_listener(self)
+
+    def close(self):
+        self.db.remove_listener(self)
+
+    def reload(self):
+        self._own = self.db.rights['own']
+        self._subjects = {}
+        self._objects = {}
+        self._subject_names = []
+        self._free_subjects = []
+        self._free_objects = []
+        self._owners = []
+        self._holders = []
+        self._owned = []
+        self._held = []
+        self._edges = {}
+        self._out = []
+        self._reach = []
+        self._back = []
+
+        for name in self.db.get_subjects():
+            self._add_subject(name)
+        for name in self.db.get_objects():
+            self._add_object(name)
+        # Рёбра без поддержки замыкания, затем замыкание целиком
+        self._closing = False
+        for subject_name, object_name, mask in self.db.iter_cells():
+            self._set_cell(subject_name, object_name, mask)
+        self._closing = True
+        for x in self._subjects.values():
+            self._reach[x] = self._search(x)
+        self._back = [0] * len(self._subject_names)
+        for x in self._subjects.values():
+            for y in _bits(self._reach[x]):
+                self._back[y] |= 1 << x
+
+    def __call__(self, event, *args):
+        if event == 'create_subject':
+            self._add_subject(args[0])
+        elif event == 'delete_subject':
+            self._remove_subject(args[0])
+        elif event == 'create_object':
+            self._add_object(args[0])
+        elif event == 'delete_object':
+            self._remove_object(args[0])
+        elif event == 'cell':
+            self._set_cell(*args)
+        elif event in RESET_EVENTS:
+            self.reload()
+
+    def _add_subject(self, name):
+        if name in self._subjects:
+            return
+        if self._free_subjects:
+            index = self._free_subjects.pop()
+            self._subject_names[index] = name
+        else:
+            index = len(self._subject_names)
+            self._subject_names.append(name)
+            self._owned.append(0)
+            self._held.append(0)
+            self._out.append(0)
+            self._reach.append(0)
+            self._back.append(0)
+        self._reach[index] = self._back[index] = 1 << index
+        self._subjects[name] = index
+
+    def _add_object(self, name):
+        if name in self._objects:
+            return
+        if self._free_objects:
+            index = self._free_objects.pop()
+        else:
+            index = len(self._owners)
+            self._owners.append(0)
+            self._holders.append(0)
+        self._objects[name] = index
+
+    def _remove_subject(self, name):
+        s = self._subjects.get(name)
+        if s is None:
+            return
+        for o in list(_bits(self._held[s])):
+            self._update(s, o, 0)
+        del self._subjects[name]
+        self._subject_names[s] = None
+        self._reach[s] = self._back[s] = 0
+        self._free_subjects.append(s)
+
+    def _remove_object(self, name):
+        o = self._objects.pop(name, None)
+        if o is None:
+            return
+        for s in list(_bits(self._holders[o])):
+            self._update(s, o, 0)
+        self._free_objects.append(o)
+
+    def _set_cell(self, subject_name, object_name, mask):
+        s = self._subjects.get(subject_name)
+        o = self._objects.get(object_name)
+        if s is not None and o is not None:
+            self._update(s, o, mask or 0)
+
+    def _update(self, s, o, mask):
+        was_owner, is_owner = bool(self._owners[o] >> s & 1), bool(mask & self._own)
+        was_holder, is_holder = bool(self._holders[o] >> s & 1), bool(mask)
+
+        # Сначала снимаем старые роли, затем добавляем новые: так счётчики
+        # рёбер между ролями одной ячейки не задваиваются
+        if was_owner and not is_owner:
+            self._owners[o] &= ~(1 << s)
+            self._owned[s] &= ~(1 << o)
+            for b in _bits(self._holders[o]):
+                self._change_edge(s, b, -1)
+        if was_holder and not is_holder:
+            self._holders[o] &= ~(1 << s)
+            self._held[s] &= ~(1 << o)
+            for a in _bits(self._owners[o]):
+                self._change_edge(a, s, -1)
+        if is_holder and not was_holder:
+            for a in _bits(self._owners[o]):
+                self._change_edge(a, s, 1)
+            self._holders[o] |= 1 << s
+            self._held[s] |= 1 << o
+        if is_owner and not was_owner:
+            for b in _bits(self._holders[o]):
+                self._change_edge(s, b, 1)
+            self._owners[o] |= 1 << s
+            self._owned[s] |= 1 << o
+
+    def _change_edge(self, a, b, delta):
+        if a == b:
+            return
+        count = self._edges.get((a, b), 0) + delta
+        if count:
+            self._edges[(a, b)] = count
+        else:
+            del self._edges[(a, b)]
+        if count == 1 and delta > 0:
+            self._out[a] |= 1 << b
+            if self._closing:
+                self._insert_edge(a, b)
+        elif count == 0:
+            self._out[a] &= ~(1 << b)
+            if self._closing:
+                self._delete_edge(a)
+
+    def _insert_edge(self, a, b):
+        if self._reach[a] >> b & 1:
+            return
+        gained = self._reach[b]
+        for x in _bits(self._back[a]):
+            new = gained & ~self._reach[x]
+            if new:
+                self._reach[x] |= new
+                for y in _bits(new):
+                    self._back[y] |= 1 << x
+
+    def _delete_edge(self, a):
+        for x in list(_bits(self._back[a])):
+            reach = self._search(x)
+            for y in _bits(self._reach[x] & ~reach):
+                self._back[y] &= ~(1 << x)
+            self._reach[x] = reach
+
+    def _search(self, x):
+        reach = frontier = 1 << x
+        while frontier:
+            following = 0
+            for y in _bits(frontier):
+                following |= self._out[y]
+            frontier = following & ~reach
+            reach |= frontier
+        return reach
+
+    def reachable(self, subject_name):
+        # Субъекты, до которых от subject_name идут цепочки выданных прав
+        s = self._subjects.get(subject_name)
+        if s is None:
+            return []
+        return sorted(self._subject_names[y] for y in _bits(self._reach[s]))
+
+    def subjects_reaching(self, object_name):
+        # Субъекты, связанные с владельцами объекта цепочками выданных прав
+        o = self._objects.get(object_name)
+        if o is None:
+            return []
+        reach = 0
+        for owner in _bits(self._owners[o]):
+            reach |= self._reach[owner]
+        return sorted(self._subject_names[y] for y in _bits(reach))
+
+    def connected(self, subject_name, object_name):
+        s = self._subjects.get(subject_name)
+        o = self._objects.get(object_name)
+        if s is None or o is None:
+            return False
+        return bool(self._back[s] & self._owners[o])
@@ -0,0 +1,135 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from async_db import WRITE_METHODS
+
+# Уровни надёжности: значение PRAGMA synchronous на время работы писателя.
+# full - fsync при каждом COMMIT группы, изменение переживает сбой питания;
+# normal - в WAL fsync только при контрольной точке, изменение переживает
+# падение процесса; off - fsync не выполняется совсем.
+DURABILITY = {'full': 'FULL', 'normal': 'NORMAL', 'off': 'OFF'}
+
+
+class GroupCommitWriter:
+    # Групповая фиксация изменений HRUDatabase. Мутаторы не выполняются в
+    # вызывающем потоке, а ставятся в очередь фонового писателя; всё, что
+    # пришло за окно window секунд (но не больше max_batch операций),
+    # выполняется в одной транзакции и фиксируется одним COMMIT. Вызов
+    # возвращает Future, который завершается после COMMIT группы. Каждая
+    # операция выполняется в своей точке сохранения, поэтому исключение в
+    # одной не отменяет остальные операции группы.
+    def __init__(self, db, window=0.002, max_batch=1000, durability='full'):
+        if durability not in DURABILITY:
+            raise ValueError(f"Неизвестный уровень надёжности {durability}")
+        self.db = db
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        with db._writing() as conn:
+            self._synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+            conn.execute(f"PRAGMA synchronous={DURABILITY[durability]}")
+        self._thread = threading.Thread(target=self._run, name='hru-group-commit', daemon=True)
+        self._thread.start()
+
+    def submit(self, name, *args, **kwargs):
+        if self._closed:
+            raise RuntimeError("Писатель остановлен")
+        future = Future()
+        self._queue.put((future, name, args, kwargs))
+        return future
+
+    def close(self):
+        # Операции, уже поставленные в очередь, выполняются до остановки
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        with self.db._writing() as conn:
+            conn.execute(f"PRAGMA synchronous={self._synchronous}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None, True
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            if batch:
+                self._execute(batch)
+
+    def _execute(self, batch):
+        db = self.db
+        outcomes = []
+        try:
+            # transaction() открывает транзакцию явным BEGIN: точки сохранения
+            # операций вложены в неё, и вся группа фиксируется одним COMMIT
+            with db.transaction():
+                cursor = db.conn.cursor()
+                for future, name, args, kwargs in batch:
+                    if not future.set_running_or_notify_cancel():
+                        outcomes.append(None)
+                        continue
+                    cursor.execute("SAVEPOINT hru_group")
+                    db._emit('savepoint')
+                    try:
+                        outcomes.append((True, getattr(db, name)(*args, **kwargs)))
+                    except Exception as error:
+                        cursor.execute("ROLLBACK TO hru_group")
+                        db._rolled_back('rollback_savepoint')
+                        outcomes.append((False, error))
+                    else:
+                        db._emit('release')
+                    cursor.execute("RELEASE hru_group")
+        except BaseException as error:
+            # COMMIT группы не удался: ни одно изменение не зафиксировано
+            for future, *_ in batch:
+                if not future.done():
+                    future.set_exception(error)
+            if not isinstance(error, Exception):
+                raise
+            return
+        self.batches += 1
+        for (future, *_), outcome in zip(batch, outcomes):
+            if outcome is None:
+                continue
+            success, value = outcome
+            if success:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+def _submit_method(name):
+    def method(self, *args, **kwargs):
+        return self.submit(name, *args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+for _name in WRITE_METHODS:
+    setattr(GroupCommitWriter, _name, _submit_method(_name))
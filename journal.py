@@ -0,0 +1,203 @@
+import json
+import os
+from pathlib import Path
+
+from commands import compile_command
+
+# Примитивные операции, которые записываются в журнал. Для каждой указано,
+# сколько аргументов события передаётся методу HRUDatabase при повторе.
+JOURNALED = {
+    'create_subject': 1,
+    'delete_subject': 1,
+    'create_object': 2,
+    'delete_object': 2,
+    'grant_right': 4,
+    'revoke_right': 4,
+    'register_right': 1,
+}
+
+
+def _segments(directory):
+    return sorted(directory.glob('journal-*.log'))
+
+
+def _checkpoints(directory):
+    return sorted(directory.glob('checkpoint-*.json'))
+
+
+def _write_atomic(path, data):
+    temp = path.with_suffix('.tmp')
+    with open(temp, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp, path)
+
+
+def read_records(directory, after=0):
+    # Недописанная последняя строка (сбой во время записи) завершает чтение
+    for segment in _segments(Path(directory)):
+        with open(segment, encoding='utf-8') as file:
+            for line in file:
+                if not line.endswith('\n'):
+                    return
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    return
+                if record['seq'] > after:
+                    yield record
+
+
+def _truncate_torn(segment):
+    # Обрезает недописанную последнюю строку, иначе новые записи
+    # продолжили бы её и стали нечитаемыми
+    with open(segment, 'rb+') as file:
+        data = file.read()
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            file.truncate(end)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def latest_checkpoint(directory):
+    checkpoints = _checkpoints(Path(directory))
+    if not checkpoints:
+        return None
+    with open(checkpoints[-1], encoding='utf-8') as file:
+        return json.load(file)
+
+
+def replay(directory, db):
+    # Восстановление: последняя контрольная точка плюс хвост журнала.
+    # db должна быть пустой; возвращается номер последней применённой записи.
+    checkpoint = latest_checkpoint(directory)
+    seq = 0
+    if checkpoint is not None:
+        success, message = db.load_dump(checkpoint)
+        if not success:
+            raise ValueError(message)
+        seq = checkpoint['seq']
+
+    plans = {}
+    with db.transaction():
+        for record in read_records(directory, seq):
+            if record['op'] == 'command':
+                source, args = record['args']
+                if source not in plans:
+                    plans[source] = compile_command(source, db)
+                db.run_command(plans[source], *args)
+            else:
+                getattr(db, record['op'])(*record['args'])
+            seq = record['seq']
+    return seq
+
+
+class Journal:
+    # Журнал примитивных операций HRUDatabase только на дозапись. Операции
+    # копятся до конца транзакции и записываются одним блоком перед COMMIT
+    # базы; fsync выполняется раз в sync_every транзакций. Откаты транзакций
+    # и точек сохранения отбрасывают соответствующие записи.
+    def __init__(self, db, directory, sync_every=1, checkpoint_every=None):
+        self.db = db
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.sync_every = sync_every
+        self.checkpoint_every = checkpoint_every
+        self._pending = []
+        self._marks = []
+        self._unsynced = 0
+        self._in_command = False
+
+        checkpoint = latest_checkpoint(self.directory)
+        self.checkpoint_seq = checkpoint['seq'] if checkpoint is not None else 0
+        self.seq = self.checkpoint_seq
+        for record in read_records(self.directory, self.seq):
+            self.seq = record['seq']
+
+        segments = _segments(self.directory)
+        if segments:
+            _truncate_torn(segments[-1])
+        self._file = open(
+            segments[-1] if segments else self._segment_path(self.seq + 1), 'a', encoding='utf-8'
+        )
+        db.add_listener(self, cells=False)
+
+    def _segment_path(self, first_seq):
+        return self.directory / f'journal-{first_seq:012d}.log'
+
+    def __call__(self, event, *args):
+        if event == 'command':
+            # Скомпилированная команда записывается целиком (текст и
+            # аргументы), её примитивы в журнал не попадают
+            self._pending.append((event, args))
+            self._in_command = True
+        elif event == 'command_done':
+            self._in_command = False
+        elif event in JOURNALED:
+            if not self._in_command:
+                self._pending.append((event, args[:JOURNALED[event]]))
+        elif event == 'savepoint':
+            self._marks.append(len(self._pending))
+        elif event == 'release':
+            if self._marks:
+                self._marks.pop()
+        elif event == 'rollback_savepoint':
+            if self._marks:
+                del self._pending[self._marks.pop():]
+        elif event == 'rollback':
+            self._pending.clear()
+            self._marks.clear()
+            self._in_command = False
+        elif event == 'precommit':
+            self._write()
+        elif event == 'commit':
+            if self.checkpoint_every and self.seq - self.checkpoint_seq >= self.checkpoint_every:
+                self.checkpoint()
+
+    def _write(self):
+        if not self._pending:
+            return
+        lines = []
+        for op, args in self._pending:
+            self.seq += 1
+            lines.append(json.dumps({'seq': self.seq, 'op': op, 'args': args}, ensure_ascii=False) + '\n')
+        self._pending.clear()
+        self._marks.clear()
+        self._file.write(''.join(lines))
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def checkpoint(self, prune=True):
+        if self._pending:
+            raise RuntimeError("Контрольная точка внутри незавершённой транзакции")
+        data = self.db.dump()
+        data['seq'] = self.seq
+        _write_atomic(self.directory / f'checkpoint-{self.seq:012d}.json', data)
+
+        # Новый сегмент начинается после контрольной точки; старые сегменты
+        # и точки ею полностью покрыты
+        self._file.flush()
+        self.sync()
+        self._file.close()
+        current = self._segment_path(self.seq + 1)
+        if prune:
+            for path in _segments(self.directory) + _checkpoints(self.directory)[:-1]:
+                if path != current:
+                    path.unlink()
+        self._file = open(current, 'a', encoding='utf-8')
+        self.checkpoint_seq = self.seq
+        return self.seq
+
+    def close(self):
+        self.db.remove_listener(self)
+        self._file.flush()
+        self.sync()
+        self._file.close()
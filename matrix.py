@@ -0,0 +1,370 @@
+import bisect
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from model import RESET_EVENTS
+
+# Двоичный формат матрицы: заголовок, таблица смещений разделов и разделы,
+# выровненные по 8 байт. Имена субъектов, объектов и прав хранятся
+# отсортированными по UTF-8 (смещения Q + общий буфер), ячейки - в виде CSR:
+# для каждого субъекта диапазон row_ptr[s]..row_ptr[s+1] в массивах индексов
+# объектов (I) и масок прав (Q). Порядок байт - little-endian.
+MATRIX_MAGIC = b'HRUM'
+MATRIX_VERSION = 1
+MATRIX_HEADER = struct.Struct('<4sIIIIQ')
+MATRIX_SECTIONS = 10
+
+
+def _bits(value):
+    while value:
+        low = value & -value
+        yield low.bit_length() - 1
+        value ^= low
+
+
+class AccessMatrix:
+    # Зеркало таблицы permissions в памяти: для каждого права хранится битовая
+    # строка на субъекта (по индексам объектов) и битовый столбец на объект
+    # (по индексам субъектов). Изменения приходят через слушатель HRUDatabase.
+    def __init__(self, db):
+        self.db = db
+        self.reload()
+        db.add_listener(self)
+
+    def close(self):
+        self.db.remove_listener(self)
+
+    def reload(self):
+        self._subjects = {}
+        self._objects = {}
+        self._subject_names = []
+        self._object_names = []
+        self._free_subjects = []
+        self._free_objects = []
+        self._rows = {right: [] for right in self.db.rights}
+        self._cols = {right: [] for right in self.db.rights}
+
+        for name in self.db.get_subjects():
+            self._add_subject(name)
+        for name in self.db.get_objects():
+            self._add_object(name)
+        for subject_name, object_name, mask in self.db.iter_cells():
+            self._set_cell(subject_name, object_name, mask)
+
+    def __call__(self, event, *args):
+        if event == 'create_subject':
+            self._add_subject(args[0])
+        elif event == 'delete_subject':
+            self._remove_subject(args[0])
+        elif event == 'create_object':
+            self._add_object(args[0])
+        elif event == 'delete_object':
+            self._remove_object(args[0])
+        elif event == 'cell':
+            self._set_cell(*args)
+        elif event == 'register_right':
+            self._rows[args[0]] = [0] * len(self._subject_names)
+            self._cols[args[0]] = [0] * len(self._object_names)
+        elif event in RESET_EVENTS:
+            self.reload()
+
+    def _add_subject(self, name):
+        if name in self._subjects:
+            return
+        if self._free_subjects:
+            index = self._free_subjects.pop()
+            self._subject_names[index] = name
+        else:
+            index = len(self._subject_names)
+            self._subject_names.append(name)
+            for rows in self._rows.values():
+                rows.append(0)
+        self._subjects[name] = index
+
+    def _add_object(self, name):
+        if name in self._objects:
+            return
+        if self._free_objects:
+            index = self._free_objects.pop()
+            self._object_names[index] = name
+        else:
+            index = len(self._object_names)
+            self._object_names.append(name)
+            for cols in self._cols.values():
+                cols.append(0)
+        self._objects[name] = index
+
+    def _remove_subject(self, name):
+        index = self._subjects.pop(name, None)
+        if index is None:
+            return
+        for right in self._rows:
+            rows, cols = self._rows[right], self._cols[right]
+            for object_index in _bits(rows[index]):
+                cols[object_index] &= ~(1 << index)
+            rows[index] = 0
+        self._subject_names[index] = None
+        self._free_subjects.append(index)
+
+    def _remove_object(self, name):
+        index = self._objects.pop(name, None)
+        if index is None:
+            return
+        for right in self._rows:
+            rows, cols = self._rows[right], self._cols[right]
+            for subject_index in _bits(cols[index]):
+                rows[subject_index] &= ~(1 << index)
+            cols[index] = 0
+        self._object_names[index] = None
+        self._free_objects.append(index)
+
+    def _set_cell(self, subject_name, object_name, mask):
+        s = self._subjects.get(subject_name)
+        o = self._objects.get(object_name)
+        if s is None or o is None:
+            return
+        for right, bit in self.db.rights.items():
+            if mask and mask & bit:
+                self._rows[right][s] |= 1 << o
+                self._cols[right][o] |= 1 << s
+            else:
+                self._rows[right][s] &= ~(1 << o)
+                self._cols[right][o] &= ~(1 << s)
+
+    def check(self, subject_name, object_name, right):
+        s = self._subjects.get(subject_name)
+        o = self._objects.get(object_name)
+        if s is None or o is None or right not in self._rows:
+            return False
+        return bool(self._rows[right][s] >> o & 1)
+
+    def get_rights(self, subject_name, object_name):
+        s = self._subjects.get(subject_name)
+        o = self._objects.get(object_name)
+        if s is None or o is None:
+            return None
+        return {right: bool(self._rows[right][s] >> o & 1) for right in self._rows}
+
+    def row(self, subject_name, right):
+        s = self._subjects.get(subject_name)
+        if s is None or right not in self._rows:
+            return []
+        return [self._object_names[o] for o in _bits(self._rows[right][s])]
+
+    def column(self, object_name, right):
+        o = self._objects.get(object_name)
+        if o is None or right not in self._cols:
+            return []
+        return [self._subject_names[s] for s in _bits(self._cols[right][o])]
+
+
+def _name_table(names):
+    offsets = array('Q', [0])
+    encoded = [name.encode() for name in names]
+    for name in encoded:
+        offsets.append(offsets[-1] + len(name))
+    return offsets, b''.join(encoded)
+
+
+def _read_matrix(snapshot):
+    rights = sorted(snapshot.rights.items(), key=lambda item: item[1])
+    subjects = sorted(snapshot.get_subjects(), key=str.encode)
+    objects = sorted(snapshot.get_objects(), key=str.encode)
+    object_index = {name: i for i, name in enumerate(objects)}
+
+    row_ptr = array('Q', [0])
+    columns = array('I')
+    masks = array('Q')
+    with snapshot._reader() as conn:
+        cells = conn.execute(
+            """SELECT s.name, o.name, p.rights
+               FROM permissions p
+               JOIN subjects s ON p.subject_id = s.id
+               JOIN objects o ON p.object_id = o.id
+               WHERE p.rights != 0
+               ORDER BY s.name, o.name"""
+        )
+        position = 0
+        for subject_name, object_name, mask in cells:
+            while subjects[position] != subject_name:
+                row_ptr.append(len(columns))
+                position += 1
+            columns.append(object_index[object_name])
+            masks.append(mask)
+    while len(row_ptr) <= len(subjects):
+        row_ptr.append(len(columns))
+    return rights, subjects, objects, row_ptr, columns, masks
+
+
+def export_matrix(db, path):
+    # Имена и ячейки читаются из одного снимка, поэтому файл согласован
+    # даже при параллельной записи. Возвращает число ячеек.
+    snapshot = db.snapshot()
+    try:
+        rights, subjects, objects, row_ptr, columns, masks = _read_matrix(snapshot)
+    finally:
+        # Снимок вызывающего (Snapshot.snapshot() возвращает его же) остаётся открытым
+        if snapshot is not db:
+            snapshot.close()
+
+    if sys.byteorder != 'little':
+        raise ValueError("Формат матрицы рассчитан на little-endian")
+    right_offsets, right_names = _name_table(name for name, _ in rights)
+    subject_offsets, subject_names = _name_table(subjects)
+    object_offsets, object_names = _name_table(objects)
+    sections = [
+        array('Q', [bit for _, bit in rights]).tobytes(),
+        right_offsets.tobytes(), right_names,
+        subject_offsets.tobytes(), subject_names,
+        object_offsets.tobytes(), object_names,
+        row_ptr.tobytes(), columns.tobytes(), masks.tobytes(),
+    ]
+
+    header = MATRIX_HEADER.pack(
+        MATRIX_MAGIC, MATRIX_VERSION, len(rights), len(subjects), len(objects), len(masks)
+    )
+    offset = MATRIX_HEADER.size + 8 * MATRIX_SECTIONS
+    table = array('Q')
+    for section in sections:
+        offset += -offset % 8
+        table.append(offset)
+        offset += len(section)
+
+    temp = f'{path}.tmp'
+    with open(temp, 'wb') as file:
+        file.write(header + table.tobytes())
+        for start, section in zip(table, sections):
+            file.write(b'\0' * (start - file.tell()))
+            file.write(section)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp, path)
+    return len(masks)
+
+
+class _NameTable:
+    # Отсортированные имена поверх mmap: бинарный поиск без декодирования
+    # всей таблицы
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        return bytes(self._blob[self._offsets[index]:self._offsets[index + 1]])
+
+    def index(self, name):
+        key = name.encode()
+        index = bisect.bisect_left(self, key)
+        if index < len(self) and self[index] == key:
+            return index
+        return None
+
+    def name(self, index):
+        return self[index].decode()
+
+
+class MappedMatrix:
+    # Матрица из файла export_matrix, открытая через mmap только для чтения.
+    # Массивы не копируются: это представления memoryview поверх страниц
+    # файла, поэтому открытие не зависит от размера матрицы, а несколько
+    # процессов с одним файлом делят одни страницы кеша.
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load()
+        except BaseException:
+            self._mmap.close()
+            raise
+
+    def _load(self):
+        if sys.byteorder != 'little':
+            raise ValueError("Формат матрицы рассчитан на little-endian")
+        view = memoryview(self._mmap)
+        self._views = [view]
+        magic, version, rights, subjects, objects, cells = MATRIX_HEADER.unpack_from(view)
+        if magic != MATRIX_MAGIC or version != MATRIX_VERSION:
+            raise ValueError("Неизвестный формат файла матрицы")
+        table = self._array(MATRIX_HEADER.size, MATRIX_SECTIONS, 'Q')
+        sizes = [rights, rights + 1, None, subjects + 1, None, objects + 1, None, subjects + 1, cells, cells]
+        formats = 'QQBQBQBQIQ'
+
+        sections = []
+        for i, (start, size, fmt) in enumerate(zip(table, sizes, formats)):
+            if size is None:
+                size = sections[i - 1][-1]
+            sections.append(self._array(start, size, fmt))
+        right_bits, right_offsets, right_names = sections[:3]
+        self.rights = {
+            bytes(right_names[right_offsets[i]:right_offsets[i + 1]]).decode(): right_bits[i]
+            for i in range(rights)
+        }
+        self._subjects = _NameTable(sections[3], sections[4])
+        self._objects = _NameTable(sections[5], sections[6])
+        self._row_ptr, self._columns, self._masks = sections[7:]
+
+    def _array(self, start, count, fmt):
+        size = struct.calcsize(fmt)
+        view = self._views[0][start:start + count * size].cast(fmt)
+        if len(view) != count:
+            raise ValueError("Файл матрицы повреждён")
+        self._views.append(view)
+        return view
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def shape(self):
+        return len(self._subjects), len(self._objects)
+
+    @property
+    def cells(self):
+        return len(self._masks)
+
+    def _mask(self, subject_name, object_name):
+        s = self._subjects.index(subject_name)
+        o = self._objects.index(object_name)
+        if s is None or o is None:
+            return None
+        start, end = self._row_ptr[s], self._row_ptr[s + 1]
+        i = bisect.bisect_left(self._columns, o, start, end)
+        if i < end and self._columns[i] == o:
+            return self._masks[i]
+        return 0
+
+    def check(self, subject_name, object_name, right):
+        mask = self._mask(subject_name, object_name)
+        return bool(mask and mask & self.rights.get(right, 0))
+
+    def get_rights(self, subject_name, object_name):
+        mask = self._mask(subject_name, object_name)
+        if mask is None:
+            return None
+        return {right: bool(mask & bit) for right, bit in self.rights.items()}
+
+    def row(self, subject_name, right):
+        s = self._subjects.index(subject_name)
+        bit = self.rights.get(right)
+        if s is None or bit is None:
+            return []
+        return [
+            self._objects.name(self._columns[i])
+            for i in range(self._row_ptr[s], self._row_ptr[s + 1])
+            if self._masks[i] & bit
+        ]
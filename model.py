@@ -1,312 +1,1472 @@
+import argparse
+import functools
+import queue
+import shlex
 import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from pathlib import Path
+
+BATCH_COMMANDS = (
+    'create_subject', 'delete_subject',
+    'create_object', 'delete_object',
+    'grant_right', 'revoke_right',
+)
+
+# Базовый алфавит прав; дополнительные права регистрируются в таблице rights
+RIGHTS = {'read': 1, 'write': 2, 'own': 4}
+OWNER_MASK = RIGHTS['read'] | RIGHTS['write'] | RIGHTS['own']
+MAX_RIGHT_BIT = 1 << 62
+
+RIGHT_LABELS = {'read': 'Чтение', 'write': 'Запись', 'own': 'Владение'}
+
+# Публичные методы HRUDatabase, для которых собирается статистика
+INSTRUMENTED = BATCH_COMMANDS + (
+    'delete_subject_by_id', 'create_object_by_id', 'delete_object_by_id',
+    'grant_right_by_id', 'revoke_right_by_id',
+    'check', 'check_by_id',
+    'get_rights', 'get_rights_by_id', 'get_rights_page',
+    'get_subjects', 'get_objects', 'search_subjects', 'search_objects',
+    'subjects_with_rights', 'objects_with_rights',
+    'delete_subjects', 'delete_objects',
+    'apply', 'run_command', 'register_right', 'dump', 'load_dump',
+)
+
+# Верхние границы корзин гистограммы времени вызова, мс
+STAT_BUCKETS_MS = (0.01, 0.1, 1, 10, 100, 1000)
+
+# События, после которых слушатели должны перечитать состояние из базы
+RESET_EVENTS = ('rollback', 'rollback_savepoint', 'reload')
+
+def _migration_base_schema(cursor):
+    # Базовая схема. Файлы, созданные до появления версий, уже содержат эти
+    # таблицы, причём permissions может быть в старом виде read/write/own.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS subjects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS objects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            owner_id INTEGER NOT NULL,
+            FOREIGN KEY (owner_id) REFERENCES subjects(id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rights (
+            name TEXT PRIMARY KEY,
+            bit INTEGER UNIQUE NOT NULL
+        )
+    ''')
+    cursor.executemany("INSERT OR IGNORE INTO rights (name, bit) VALUES (?, ?)", RIGHTS.items())
+
+    cursor.execute("PRAGMA table_info(permissions)")
+    columns = [row[1] for row in cursor.fetchall()]
+    if 'read' in columns:
+        cursor.execute("ALTER TABLE permissions RENAME TO permissions_columns")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS permissions (
+            subject_id INTEGER NOT NULL,
+            object_id INTEGER NOT NULL,
+            rights INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (subject_id, object_id),
+            FOREIGN KEY (subject_id) REFERENCES subjects(id),
+            FOREIGN KEY (object_id) REFERENCES objects(id)
+        )
+    ''')
+    if 'read' in columns:
+        cursor.execute(f'''
+            INSERT INTO permissions (subject_id, object_id, rights)
+            SELECT subject_id, object_id,
+                   (read != 0) * {RIGHTS['read']}
+                   + (write != 0) * {RIGHTS['write']}
+                   + (own != 0) * {RIGHTS['own']}
+            FROM permissions_columns
+        ''')
+        cursor.execute("DROP TABLE permissions_columns")
+
+
+def _migration_without_rowid(cursor):
+    # Строки permissions маленькие и адресуются составным ключом: в таблице
+    # WITHOUT ROWID они лежат прямо в B-дереве первичного ключа.
+    cursor.execute('''
+        CREATE TABLE permissions_clustered (
+            subject_id INTEGER NOT NULL,
+            object_id INTEGER NOT NULL,
+            rights INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (subject_id, object_id),
+            FOREIGN KEY (subject_id) REFERENCES subjects(id),
+            FOREIGN KEY (object_id) REFERENCES objects(id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT INTO permissions_clustered (subject_id, object_id, rights)
+        SELECT subject_id, object_id, rights FROM permissions
+    ''')
+    cursor.execute("DROP TABLE permissions")
+    cursor.execute("ALTER TABLE permissions_clustered RENAME TO permissions")
+
+
+def _migration_indexes(cursor):
+    # Покрывающий индекс для просмотра столбца матрицы (права на объект) и
+    # индекс владельцев для передачи владения при удалении субъекта.
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS permissions_by_object
+        ON permissions (object_id, subject_id, rights)
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS objects_by_owner ON objects (owner_id)")
+
+
+MIGRATIONS = (
+    _migration_base_schema,
+    _migration_without_rowid,
+    _migration_indexes,
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+class DecisionCache:
+    # LRU-кэш масок прав по ячейкам для check(). Запись хранит поколения
+    # субъекта и объекта на момент вычисления; создание/удаление сущности или
+    # передача владения увеличивают поколение, и устаревшие записи
+    # отбрасываются при чтении. События приходят до commit, поэтому
+    # инвалидация повторяется при фиксации транзакции, а put() отклоняет
+    # значения, прочитанные до последнего commit.
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._subject_gen = {}
+        self._object_gen = {}
+        self._pending = []
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def token(self, subject_name, object_name):
+        with self._lock:
+            return (self._epoch, self._subject_gen.get(subject_name, 0),
+                    self._object_gen.get(object_name, 0))
+
+    def get(self, subject_name, object_name):
+        key = (subject_name, object_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                mask, generations = entry
+                if generations == (self._subject_gen.get(subject_name, 0),
+                                   self._object_gen.get(object_name, 0)):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return mask
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, subject_name, object_name, mask, token):
+        if not self.maxsize:
+            return
+        key = (subject_name, object_name)
+        with self._lock:
+            if token[0] != self._epoch:
+                return
+            self._entries[key] = (mask, token[1:])
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
+            self._epoch += 1
+
+    def _invalidate(self, kind, name, other=None):
+        if kind == 'cell':
+            self._entries.pop((name, other), None)
+        elif kind == 'subject':
+            self._subject_gen[name] = self._subject_gen.get(name, 0) + 1
+        else:
+            self._object_gen[name] = self._object_gen.get(name, 0) + 1
+
+    def __call__(self, event, *args):
+        if event in RESET_EVENTS:
+            self.clear()
+            return
+
+        if event in ('grant_right', 'revoke_right'):
+            actions = [('cell', args[1], args[2])]
+        elif event in ('cell', 'touch'):
+            actions = [('cell', args[0], args[1])]
+        elif event in ('create_subject', 'delete_subject'):
+            actions = [('subject', args[0])]
+        elif event in ('create_object', 'delete_object'):
+            actions = [('object', args[0])]
+        elif event == 'transfer_objects':
+            actions = [('object', object_name) for object_name in args[2]]
+        elif event == 'commit':
+            with self._lock:
+                for action in self._pending:
+                    self._invalidate(*action)
+                self._pending.clear()
+                self._epoch += 1
+            return
+        else:
+            return
+
+        with self._lock:
+            for action in actions:
+                self._invalidate(*action)
+            self._pending.extend(actions)
+
+def _result_rows(result):
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    return 1
+
+class Profiler:
+    # Статистика вызовов методов HRUDatabase: число вызовов, гистограмма
+    # времени, число SQL-инструкций и затронутых строк. Время и инструкции
+    # считаются включительно с вложенными вызовами. Для записи строки - это
+    # изменённые строки, для чтения - возвращённые. Вызовы дольше slow_ms
+    # попадают в журнал медленных запросов вместе с выполненным SQL, в
+    # который SQLite уже подставил параметры.
+    def __init__(self, slow_ms=None, slow_log_size=100):
+        self.slow_ms = slow_ms
+        self.slow_log = deque(maxlen=slow_log_size)
+        self._methods = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def trace(self, statement):
+        local = self._local
+        local.statements = getattr(local, 'statements', 0) + 1
+        log = getattr(local, 'log', None)
+        if log is not None:
+            log.append(statement)
+
+    def wrap(self, db, name, method, writer):
+        local = self._local
+
+        def measure(args, kwargs):
+            statements = getattr(local, 'statements', 0)
+            outer = self.slow_ms is not None and getattr(local, 'log', None) is None
+            if outer:
+                local.log = []
+            rows = 0
+            started = time.perf_counter()
+            try:
+                if writer:
+                    changes = db.conn.total_changes
+                    result = method(*args, **kwargs)
+                    rows = db.conn.total_changes - changes
+                else:
+                    result = method(*args, **kwargs)
+                    rows = _result_rows(result)
+                return result
+            finally:
+                elapsed = (time.perf_counter() - started) * 1000
+                if outer:
+                    log, local.log = local.log, None
+                    if elapsed >= self.slow_ms:
+                        self.slow_log.append({
+                            'method': name,
+                            'args': repr(args),
+                            'ms': elapsed,
+                            'statements': log,
+                        })
+                self._record(name, elapsed, getattr(local, 'statements', 0) - statements, rows)
+
+        def wrapper(*args, **kwargs):
+            if writer:
+                with db._writing():
+                    return measure(args, kwargs)
+            return measure(args, kwargs)
+
+        wrapper.__name__ = name
+        return wrapper
+
+    def _record(self, name, elapsed, statements, rows):
+        bucket = 0
+        while bucket < len(STAT_BUCKETS_MS) and elapsed > STAT_BUCKETS_MS[bucket]:
+            bucket += 1
+        with self._lock:
+            stats = self._methods.get(name)
+            if stats is None:
+                stats = self._methods[name] = [0, 0.0, 0.0, 0, 0, [0] * (len(STAT_BUCKETS_MS) + 1)]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            stats[3] += statements
+            stats[4] += rows
+            stats[5][bucket] += 1
+
+    def snapshot(self):
+        labels = [f"<={edge}ms" for edge in STAT_BUCKETS_MS] + [f">{STAT_BUCKETS_MS[-1]}ms"]
+        with self._lock:
+            methods = {
+                name: {
+                    'calls': calls,
+                    'total_ms': total,
+                    'mean_ms': total / calls,
+                    'max_ms': longest,
+                    'statements': statements,
+                    'rows': rows,
+                    'histogram': dict(zip(labels, histogram)),
+                }
+                for name, (calls, total, longest, statements, rows, histogram) in sorted(self._methods.items())
+            }
+            return {'methods': methods, 'slow_queries': list(self.slow_log)}
+
+def _prefix_end(prefix):
+    # Наименьшая строка, которая больше всех строк с данным префиксом
+    while prefix:
+        code = ord(prefix[-1]) + 1
+        if code == 0xD800:
+            code = 0xE000
+        if code <= 0x10FFFF:
+            return prefix[:-1] + chr(code)
+        prefix = prefix[:-1]
+    return None
+
+def _writer(method):
+    # Метод выполняется под блокировкой единственного пишущего соединения
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._writing():
+            return method(self, *args, **kwargs)
+    return wrapper
 
 class HRUDatabase:
-    def __init__(self):
-        self.conn = sqlite3.connect('hru_model.db')
+    def __init__(self, path='hru_model.db', cache_size=4096, readers=4):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._tx_depth = 0
+        self._listeners = []
+        self._cell_listeners = 0
+        self.cache = DecisionCache(cache_size)
+        self.add_listener(self.cache, cells=False)
+
+        memory = path == ':memory:'
+        if not memory:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
         self.create_tables()
+        self._load_rights()
+        self._load_names()
+
+        # Пул соединений только для чтения; в WAL читатели не блокируют
+        # писателя и друг друга. Для :memory: читают через пишущее соединение.
+        self._readers = queue.Queue()
+        self._reader_count = 0 if memory else readers
+        self._reader_connections = []
+        self._uri = None if memory else Path(path).absolute().as_uri() + '?mode=ro'
+        if self._reader_count:
+            for _ in range(self._reader_count):
+                conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+                self._reader_connections.append(conn)
+                self._readers.put(conn)
+
+        self.profiler = None
+
+    def enable_stats(self, slow_ms=None):
+        # Обёртки ставятся на экземпляр, поэтому без статистики методы
+        # вызываются напрямую и ничего не стоят
+        self.disable_stats()
+        self.profiler = Profiler(slow_ms)
+        for conn in [self.conn, *self._reader_connections]:
+            conn.set_trace_callback(self.profiler.trace)
+        for name in INSTRUMENTED:
+            method = getattr(type(self), name)
+            setattr(self, name, self.profiler.wrap(
+                self, name, method.__get__(self), hasattr(method, '__wrapped__')
+            ))
+
+    def disable_stats(self):
+        for name in INSTRUMENTED:
+            self.__dict__.pop(name, None)
+        for conn in [self.conn, *self._reader_connections]:
+            conn.set_trace_callback(None)
+
+    def stats(self):
+        if self.profiler is None:
+            return None
+        return self.profiler.snapshot()
 
+    def close(self):
+        with self._lock:
+            self._reader_count = 0
+            while True:
+                try:
+                    self._readers.get_nowait().close()
+                except queue.Empty:
+                    break
+            self.conn.close()
+
+    @contextmanager
+    def _writing(self):
+        with self._lock:
+            self._local.writes = getattr(self._local, 'writes', 0) + 1
+            try:
+                yield self.conn
+            finally:
+                self._local.writes -= 1
+
+    @contextmanager
+    def _reader(self):
+        # Поток, удерживающий блокировку писателя (например, внутри своей
+        # транзакции), читает через пишущее соединение и видит собственные
+        # незафиксированные изменения.
+        if not self._reader_count or getattr(self._local, 'writes', 0):
+            with self._writing() as conn:
+                yield conn
+            return
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @_writer
     def create_tables(self):
+        # Схема версионируется через PRAGMA user_version: применяются только
+        # миграции новее версии файла, каждая в своей транзакции.
         cursor = self.conn.cursor()
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS subjects (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE NOT NULL
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise sqlite3.DatabaseError(
+                f"Версия схемы базы {version} новее поддерживаемой {SCHEMA_VERSION}"
             )
-        ''')
 
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS objects (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE NOT NULL,
-                owner_id INTEGER NOT NULL,
-                FOREIGN KEY (owner_id) REFERENCES subjects(id)
-            )
-        ''')
+        for target in range(version + 1, SCHEMA_VERSION + 1):
+            cursor.execute("BEGIN")
+            try:
+                MIGRATIONS[target - 1](cursor)
+                cursor.execute(f"PRAGMA user_version = {target}")
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+
+    def schema_version(self):
+        with self._reader() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def _load_rights(self):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT name, bit FROM rights ORDER BY bit")
+        self.rights = dict(cursor.fetchall())
+        self._own_bit = self.rights['own']
+
+    @_writer
+    def register_right(self, name):
+        name = name.strip() if isinstance(name, str) else ''
+        if not name.isidentifier():
+            return False, "Некорректное имя права"
+        if name in self.rights:
+            return False, f"Право {name} уже существует"
+        bit = max(self.rights.values()) << 1 if self.rights else 1
+        if bit > MAX_RIGHT_BIT:
+            return False, "Достигнут предел количества прав"
+
+        cursor = self.conn.cursor()
+        cursor.execute("INSERT INTO rights (name, bit) VALUES (?, ?)", (name, bit))
+        self.rights[name] = bit
+        self._emit('register_right', name, bit)
+        self._commit()
+        return True, f"Право {name} зарегистрировано"
+
+    def rights_mask(self, rights):
+        # Имя права или набор имён -> битовая маска; None при неизвестном праве
+        if isinstance(rights, str):
+            rights = (rights,)
+        mask = 0
+        for right in rights:
+            bit = self.rights.get(right)
+            if bit is None:
+                return None
+            mask |= bit
+        return mask or None
+
+    def mask_to_rights(self, mask):
+        return {right: bool(mask & bit) for right, bit in self.rights.items()}
 
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS permissions (
-                subject_id INTEGER NOT NULL,
-                object_id INTEGER NOT NULL,
-                read INTEGER DEFAULT 0,
-                write INTEGER DEFAULT 0,
-                own INTEGER DEFAULT 0,
-                PRIMARY KEY (subject_id, object_id),
-                FOREIGN KEY (subject_id) REFERENCES subjects(id),
-                FOREIGN KEY (object_id) REFERENCES objects(id)
+    def _load_names(self):
+        # Интернирование имён: словари имя <-> id избавляют мутаторы и
+        # проверки от подзапросов (SELECT id FROM ... WHERE name = ?).
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT id, name FROM subjects")
+        self._subject_names = dict(cursor.fetchall())
+        self._subject_ids = {name: id for id, name in self._subject_names.items()}
+        cursor.execute("SELECT id, name FROM objects")
+        self._object_names = dict(cursor.fetchall())
+        self._object_ids = {name: id for id, name in self._object_names.items()}
+
+    def subject_id(self, name):
+        return self._subject_ids.get(name)
+
+    def object_id(self, name):
+        return self._object_ids.get(name)
+
+    def subject_name(self, subject_id):
+        return self._subject_names.get(subject_id)
+
+    def object_name(self, object_id):
+        return self._object_names.get(object_id)
+
+    def add_listener(self, listener, cells=True):
+        # cells=False - слушателю не нужны события 'cell' с итоговой маской
+        # ячейки, и мутаторы не тратят на них дополнительный запрос.
+        self._listeners.append((listener, cells))
+        self._cell_listeners += cells
+
+    def remove_listener(self, listener):
+        for i, (registered, cells) in enumerate(self._listeners):
+            if registered is listener:
+                del self._listeners[i]
+                self._cell_listeners -= cells
+                return
+
+    def _emit(self, event, *args):
+        for listener, _ in list(self._listeners):
+            listener(event, *args)
+
+    def _emit_cell(self, subject_id, object_id):
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT rights FROM permissions WHERE subject_id = ? AND object_id = ?",
+            (subject_id, object_id)
+        )
+        row = cursor.fetchone()
+        self._emit('cell', self._subject_names[subject_id], self._object_names[object_id],
+                   row[0] if row else None)
+
+    def _rolled_back(self, event):
+        self._load_rights()
+        self._load_names()
+        self._emit(event)
+
+    @_writer
+    def reload(self):
+        # Для случаев, когда таблицы изменены в обход HRUDatabase
+        self._rolled_back('reload')
+
+    def _commit(self):
+        if not self._tx_depth:
+            self._emit('precommit')
+            self.conn.commit()
+            self._emit('commit')
+
+    def _abandon(self):
+        # Неудавшийся INSERT открыл неявную транзакцию; вне transaction()
+        # её никто не завершит, и соединение осталось бы в транзакции
+        if not self._tx_depth:
+            self.conn.rollback()
+
+    @contextmanager
+    def transaction(self):
+        # Внутри транзакции мутаторы не коммитят: всё фиксируется одним commit
+        # при выходе из внешнего блока или откатывается при исключении.
+        # Блокировка писателя удерживается на всё время транзакции.
+        with self._writing():
+            if not self._tx_depth and not self.conn.in_transaction:
+                # Без явного BEGIN первый SAVEPOINT сам открывает транзакцию,
+                # и его RELEASE фиксирует всё, что сделано до него
+                self.conn.execute("BEGIN")
+            self._tx_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._tx_depth -= 1
+                if not self._tx_depth:
+                    self.conn.rollback()
+                    self._rolled_back('rollback')
+                raise
+            self._tx_depth -= 1
+            self._commit()
+
+    def snapshot(self):
+        # Согласованное представление на текущий момент. Для файла - своё
+        # соединение только для чтения с открытой транзакцией: в WAL оно
+        # видит зафиксированное до её начала состояние и не мешает писателю.
+        # Для :memory: - копия базы через backup под блокировкой писателя.
+        # Пока снимок открыт, WAL не может быть полностью перезаписан,
+        # поэтому снимок нужно закрывать (close или with).
+        if self._uri is not None:
+            conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+            conn.execute("BEGIN")
+        else:
+            with self._writing():
+                # backup ждёт завершения транзакции пишущего соединения, а
+                # в этом потоке она не завершится никогда
+                if self._tx_depth or self.conn.in_transaction:
+                    raise RuntimeError("Снимок базы :memory: внутри незавершённой транзакции")
+                conn = sqlite3.connect(':memory:', check_same_thread=False)
+                self.conn.backup(conn)
+        return Snapshot(conn)
+
+    @_writer
+    def dump(self):
+        # Полный снимок таблиц с исходными id и счётчиками AUTOINCREMENT
+        cursor = self.conn.cursor()
+        return {
+            'schema': SCHEMA_VERSION,
+            'rights': cursor.execute("SELECT name, bit FROM rights ORDER BY bit").fetchall(),
+            'subjects': cursor.execute("SELECT id, name FROM subjects ORDER BY id").fetchall(),
+            'objects': cursor.execute("SELECT id, name, owner_id FROM objects ORDER BY id").fetchall(),
+            'permissions': cursor.execute(
+                "SELECT subject_id, object_id, rights FROM permissions"
+            ).fetchall(),
+            'sequences': cursor.execute("SELECT name, seq FROM sqlite_sequence").fetchall(),
+        }
+
+    @_writer
+    def load_dump(self, data):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT (SELECT COUNT(*) FROM subjects) + (SELECT COUNT(*) FROM objects)")
+        if cursor.fetchone()[0]:
+            return False, "База не пуста"
+
+        with self.transaction():
+            cursor.execute("DELETE FROM rights")
+            cursor.executemany("INSERT INTO rights (name, bit) VALUES (?, ?)", data['rights'])
+            cursor.executemany("INSERT INTO subjects (id, name) VALUES (?, ?)", data['subjects'])
+            cursor.executemany("INSERT INTO objects (id, name, owner_id) VALUES (?, ?, ?)", data['objects'])
+            cursor.executemany(
+                "INSERT INTO permissions (subject_id, object_id, rights) VALUES (?, ?, ?)",
+                data['permissions']
             )
-        ''')
+            cursor.execute("DELETE FROM sqlite_sequence")
+            cursor.executemany("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", data['sequences'])
+        self.reload()
+        return True, "Состояние загружено"
+
+    @_writer
+    def apply(self, commands, atomic=True):
+        # atomic=False: одна транзакция без отката пакета, ошибочные команды
+        # просто пропускаются
+        commands = [tuple(command) for command in commands]
+        if not atomic:
+            with self.transaction():
+                return self._apply_commands(commands, stop_on_failure=False)[0]
+
+        with self.transaction():
+            cursor = self.conn.cursor()
+            cursor.execute("SAVEPOINT hru_apply")
+            self._emit('savepoint')
+            try:
+                results, failed = self._apply_commands(commands)
+            except BaseException:
+                cursor.execute("ROLLBACK TO hru_apply")
+                cursor.execute("RELEASE hru_apply")
+                self._rolled_back('rollback_savepoint')
+                raise
+            if failed is not None:
+                cursor.execute("ROLLBACK TO hru_apply")
+                self._rolled_back('rollback_savepoint')
+            else:
+                self._emit('release')
+            cursor.execute("RELEASE hru_apply")
+
+        if failed is None:
+            return results
+        return [
+            results[i] if i == failed else (False, "Команда отменена: пакет откатан")
+            for i in range(len(commands))
+        ]
+
+    def _apply_commands(self, commands, stop_on_failure=True):
+        results = []
+        i = 0
+        while i < len(commands):
+            start = len(results)
+            name = commands[i][0] if commands[i] else None
+            if name == 'create_subject':
+                # Подряд идущие создания субъектов вставляются одним executemany
+                j = i
+                while j < len(commands) and commands[j] and commands[j][0] == 'create_subject':
+                    j += 1
+                results.extend(self._create_subjects([command[1] for command in commands[i:j]]))
+                i = j
+            elif name in BATCH_COMMANDS:
+                results.append(getattr(self, name)(*commands[i][1:]))
+                i += 1
+            else:
+                results.append((False, f"Неизвестная команда {name}"))
+                i += 1
 
-        self.conn.commit()
+            if stop_on_failure:
+                for k in range(start, len(results)):
+                    if not results[k][0]:
+                        return results, k
+        return results, None
 
+    def _create_subjects(self, names):
+        cursor = self.conn.cursor()
+        cursor.execute("SAVEPOINT hru_subjects")
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM subjects")
+        last_id = cursor.fetchone()[0]
+        try:
+            cursor.executemany("INSERT INTO subjects (name) VALUES (?)", [(name,) for name in names])
+        except sqlite3.IntegrityError:
+            # Среди имён есть занятые: повторяем по одному, чтобы получить
+            # результат каждой команды
+            cursor.execute("ROLLBACK TO hru_subjects")
+            cursor.execute("RELEASE hru_subjects")
+            return [self.create_subject(name) for name in names]
+        cursor.execute("RELEASE hru_subjects")
+        cursor.execute("SELECT id, name FROM subjects WHERE id > ?", (last_id,))
+        for subject_id, name in cursor.fetchall():
+            self._subject_names[subject_id] = name
+            self._subject_ids[name] = subject_id
+        for name in names:
+            self._emit('create_subject', name)
+        return [(True, f"Субъект {name} создан") for name in names]
+
+    @_writer
+    def run_command(self, plan, *args):
+        # Выполнение скомпилированной команды (commands.CommandPlan): все
+        # условия - один SELECT, затем операции плана; всё в одной транзакции
+        if len(args) != len(plan.params):
+            return False, f"Команда {plan.name}: ожидается аргументов: {len(plan.params)}"
+
+        ids = {}
+        for param, value in zip(plan.params, args):
+            names = self._object_ids if plan.kinds.get(param) == 'object' else self._subject_ids
+            if param in plan.created:
+                if value in self._subject_ids or value in self._object_ids:
+                    return False, f"Команда {plan.name}: {value} уже существует"
+            elif value not in names:
+                return False, f"Команда {plan.name}: {value} не существует"
+            else:
+                ids[param] = names[value]
+        values = dict(zip(plan.params, args))
+
+        cursor = self.conn.cursor()
+        if plan.condition_sql:
+            params = []
+            for (subject, obj), mask in plan.conditions:
+                params += [ids[subject], ids[obj], mask, mask]
+            cursor.execute(plan.condition_sql, params)
+            if not cursor.fetchone()[0]:
+                return False, f"Команда {plan.name}: условия не выполнены"
+
+        touched = []
+        try:
+            self._run_steps(plan, cursor, ids, values, touched)
+        except sqlite3.IntegrityError:
+            return False, f"Команда {plan.name}: имена создаваемых сущностей совпадают"
+        return True, f"Команда {plan.name} выполнена"
+
+    def _run_steps(self, plan, cursor, ids, values, touched):
+        with self.transaction():
+            # Точка сохранения откатывает только эту команду, даже если она
+            # выполняется внутри внешней транзакции
+            cursor.execute("SAVEPOINT hru_command")
+            self._emit('savepoint')
+            try:
+                self._run_plan(plan, cursor, ids, values, touched)
+            except BaseException:
+                self._emit('command_done')
+                cursor.execute("ROLLBACK TO hru_command")
+                cursor.execute("RELEASE hru_command")
+                self._rolled_back('rollback_savepoint')
+                raise
+            self._emit('release')
+            cursor.execute("RELEASE hru_command")
+
+    def _run_plan(self, plan, cursor, ids, values, touched):
+        # Журнал записывает команду целиком; события примитивов внутри
+        # скобок command/command_done нужны только зеркалам и кэшу
+        self._emit('command', plan.source, list(values.values()))
+        for step in plan.steps:
+            kind = step[0]
+            if kind == 'create_subject':
+                name = values[step[1]]
+                cursor.execute(plan.sql[kind], (name,))
+                ids[step[1]] = cursor.lastrowid
+                self._subject_names[cursor.lastrowid] = name
+                self._subject_ids[name] = cursor.lastrowid
+                self._emit('create_subject', name)
+            elif kind == 'create_object':
+                name = values[step[1]]
+                cursor.execute(plan.sql[kind], (name, ids[step[2]]))
+                ids[step[1]] = cursor.lastrowid
+                self._object_names[cursor.lastrowid] = name
+                self._object_ids[name] = cursor.lastrowid
+                self._emit('create_object', name, values[step[2]])
+            elif kind == 'enter':
+                cursor.execute(plan.sql[kind], (ids[step[1]], ids[step[2]], step[3]))
+                touched.append((ids[step[1]], ids[step[2]]))
+            elif kind == 'delete':
+                cursor.execute(plan.sql[kind], (step[3], ids[step[1]], ids[step[2]]))
+                touched.append((ids[step[1]], ids[step[2]]))
+            elif kind == 'destroy_subject':
+                if ids[step[1]] in self._subject_names:
+                    self._delete_subjects([ids[step[1]]])
+            elif kind == 'destroy_object':
+                object_id = ids[step[1]]
+                name = self._object_names.pop(object_id, None)
+                if name is not None:
+                    cursor.execute(plan.sql['destroy_cells'], (object_id,))
+                    cursor.execute(plan.sql[kind], (object_id,))
+                    del self._object_ids[name]
+                    self._emit('delete_object', name, None)
+        for subject_id, object_id in dict.fromkeys(touched):
+            if subject_id in self._subject_names and object_id in self._object_names:
+                self._emit('touch', self._subject_names[subject_id], self._object_names[object_id])
+                if self._cell_listeners:
+                    self._emit_cell(subject_id, object_id)
+        self._emit('command_done')
+
+    @_writer
     def create_subject(self, name):
         try:
             cursor = self.conn.cursor()
             cursor.execute("INSERT INTO subjects (name) VALUES (?)", (name,))
-            self.conn.commit()
+            self._subject_names[cursor.lastrowid] = name
+            self._subject_ids[name] = cursor.lastrowid
+            self._emit('create_subject', name)
+            self._commit()
             return True, f"Субъект {name} создан"
         except sqlite3.IntegrityError:
+            self._abandon()
             return False, f"Субъект {name} уже существует"
 
+    @_writer
     def delete_subject(self, name):
-        cursor = self.conn.cursor()
-
-        cursor.execute("SELECT id FROM subjects WHERE name=?", (name,))
-        subject = cursor.fetchone()
-        if not subject:
+        subject_id = self._subject_ids.get(name)
+        if subject_id is None:
             return False, f"Субъект {name} не существует"
-
-        cursor.execute("SELECT id FROM subjects WHERE id != ? LIMIT 1", (subject[0],))
-        new_owner = cursor.fetchone()
-
-        if new_owner:
-            cursor.execute(
-                "UPDATE objects SET owner_id=? WHERE owner_id=?",
-                (new_owner[0], subject[0])
-            )
-            cursor.execute(
-                "UPDATE permissions SET own=1 WHERE object_id IN (SELECT id FROM objects WHERE owner_id=?)",
-                (new_owner[0],)
-            )
-
-        cursor.execute("DELETE FROM subjects WHERE id=?", (subject[0],))
-        self.conn.commit()
+        return self.delete_subject_by_id(subject_id)
+
+    @_writer
+    def delete_subject_by_id(self, subject_id):
+        name = self._subject_names.get(subject_id)
+        if name is None:
+            return False, f"Субъект с id {subject_id} не существует"
+        self._delete_subjects([subject_id])
+        self._commit()
         return True, f"Субъект {name} удален"
 
-    def create_object(self, object_name, owner_name):
+    @_writer
+    def delete_subjects(self, names):
+        names = list(dict.fromkeys(names))
+        missing = [name for name in names if name not in self._subject_ids]
+        if missing:
+            return False, f"Субъекты не существуют: {', '.join(missing)}"
+        with self.transaction():
+            self._delete_subjects([self._subject_ids[name] for name in names])
+        return True, f"Удалено субъектов: {len(names)}"
+
+    def _delete_subjects(self, subject_ids):
+        # Объекты удаляемых субъектов, а также объекты, теряющие последнего
+        # субъекта с правом own, переходят к оставшемуся совладельцу с
+        # наименьшим id, иначе - к прежнему владельцу, если он остаётся,
+        # иначе - к оставшемуся субъекту с наименьшим id. Если субъектов не
+        # остаётся, объекты удаляются. Строки прав удаляемых субъектов
+        # удаляются вместе с ними.
         cursor = self.conn.cursor()
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS hru_deleted (id INTEGER PRIMARY KEY)")
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS hru_reassign (object_id INTEGER PRIMARY KEY, old_owner, new_owner)"
+        )
+        cursor.executemany("INSERT INTO hru_deleted (id) VALUES (?)", [(i,) for i in subject_ids])
 
-        cursor.execute("SELECT id FROM subjects WHERE name=?", (owner_name,))
-        owner = cursor.fetchone()
-        if not owner:
+        cursor.execute("SELECT MIN(id) FROM subjects WHERE id NOT IN (SELECT id FROM hru_deleted)")
+        fallback = cursor.fetchone()[0]
+        cursor.execute(
+            """INSERT INTO hru_reassign (object_id, old_owner, new_owner)
+               SELECT id, owner_id, COALESCE(
+                   holder,
+                   CASE WHEN owner_id NOT IN (SELECT id FROM hru_deleted) THEN owner_id END,
+                   ?)
+               FROM (
+                   SELECT o.id, o.owner_id,
+                          (SELECT MIN(p.subject_id) FROM permissions p
+                           WHERE p.object_id = o.id AND p.rights & ? != 0
+                             AND p.subject_id NOT IN (SELECT id FROM hru_deleted)) AS holder
+                   FROM objects o
+                   WHERE o.owner_id IN (SELECT id FROM hru_deleted)
+                      OR o.id IN (SELECT object_id FROM permissions
+                                  WHERE subject_id IN (SELECT id FROM hru_deleted) AND rights & ? != 0)
+               )
+               WHERE owner_id IN (SELECT id FROM hru_deleted) OR holder IS NULL""",
+            (fallback, self._own_bit, self._own_bit)
+        )
+        cursor.execute(
+            """UPDATE objects SET owner_id = (
+                   SELECT new_owner FROM hru_reassign WHERE object_id = objects.id)
+               WHERE id IN (SELECT object_id FROM hru_reassign WHERE new_owner IS NOT NULL)"""
+        )
+        cursor.execute(
+            """INSERT INTO permissions (subject_id, object_id, rights)
+               SELECT new_owner, object_id, ? FROM hru_reassign WHERE new_owner IS NOT NULL
+               ON CONFLICT(subject_id, object_id) DO UPDATE SET rights = rights | excluded.rights""",
+            (self._own_bit,)
+        )
+        cursor.execute(
+            """DELETE FROM permissions WHERE subject_id IN (SELECT id FROM hru_deleted)
+               OR object_id IN (SELECT object_id FROM hru_reassign WHERE new_owner IS NULL)"""
+        )
+        cursor.execute(
+            "DELETE FROM objects WHERE id IN (SELECT object_id FROM hru_reassign WHERE new_owner IS NULL)"
+        )
+        cursor.execute("DELETE FROM subjects WHERE id IN (SELECT id FROM hru_deleted)")
+
+        cursor.execute(
+            """SELECT r.object_id, r.old_owner, r.new_owner, p.rights FROM hru_reassign r
+               LEFT JOIN permissions p ON p.subject_id = r.new_owner AND p.object_id = r.object_id
+               ORDER BY r.old_owner, r.new_owner, r.object_id"""
+        )
+        moved = cursor.fetchall()
+        cursor.execute("DELETE FROM hru_deleted")
+        cursor.execute("DELETE FROM hru_reassign")
+
+        old_names = {subject_id: self._subject_names[subject_id] for subject_id in subject_ids}
+        transfers = {}
+        cells = []
+        for object_id, old_owner, new_owner, mask in moved:
+            object_name = self._object_names[object_id]
+            if new_owner is None:
+                del self._object_names[object_id]
+                del self._object_ids[object_name]
+                self._emit('delete_object', object_name, old_names[old_owner])
+            else:
+                if old_owner in old_names:
+                    transfers.setdefault((old_owner, new_owner), []).append(object_name)
+                cells.append((new_owner, object_name, mask))
+
+        for subject_id, name in old_names.items():
+            del self._subject_names[subject_id]
+            del self._subject_ids[name]
+            self._emit('delete_subject', name)
+        for (old_owner, new_owner), objects in transfers.items():
+            self._emit('transfer_objects', old_names[old_owner], self._subject_names[new_owner], objects)
+        # Переданное own меняет ячейку и тогда, когда удалённый субъект не был
+        # owner_id объекта, поэтому кэш решений сбрасывается по каждой ячейке
+        for new_owner, object_name, mask in cells:
+            self._emit('touch', self._subject_names[new_owner], object_name)
+            if self._cell_listeners:
+                self._emit('cell', self._subject_names[new_owner], object_name, mask)
+
+    @_writer
+    def create_object(self, object_name, owner_name):
+        owner_id = self._subject_ids.get(owner_name)
+        if owner_id is None:
             return False, f"Субъект-владелец {owner_name} не существует"
+        return self.create_object_by_id(object_name, owner_id)
+
+    @_writer
+    def create_object_by_id(self, object_name, owner_id):
+        owner_name = self._subject_names.get(owner_id)
+        if owner_name is None:
+            return False, f"Субъект-владелец с id {owner_id} не существует"
 
+        cursor = self.conn.cursor()
         try:
             cursor.execute(
                 "INSERT INTO objects (name, owner_id) VALUES (?, ?)",
-                (object_name, owner[0])
+                (object_name, owner_id)
             )
             object_id = cursor.lastrowid
 
             cursor.execute(
-                """INSERT INTO permissions 
-                   (subject_id, object_id, read, write, own) 
-                   VALUES (?, ?, ?, ?, ?)""",
-                (owner[0], object_id, 1, 1, 1)
+                "INSERT INTO permissions (subject_id, object_id, rights) VALUES (?, ?, ?)",
+                (owner_id, object_id, OWNER_MASK)
             )
 
-            self.conn.commit()
+            self._object_names[object_id] = object_name
+            self._object_ids[object_name] = object_id
+            self._emit('create_object', object_name, owner_name)
+            self._emit('cell', owner_name, object_name, OWNER_MASK)
+            self._commit()
             return True, f"Объект {object_name} создан с владельцем {owner_name}"
         except sqlite3.IntegrityError:
+            self._abandon()
             return False, f"Объект {object_name} уже существует"
 
+    @_writer
     def delete_object(self, object_name, subject_name):
-        cursor = self.conn.cursor()
+        object_id = self._object_ids.get(object_name)
+        subject_id = self._subject_ids.get(subject_name)
+        if object_id is None or subject_id is None:
+            return False, "Нет прав на удаление объекта или объект не существует"
+        return self.delete_object_by_id(object_id, subject_id)
 
-        cursor.execute(
-            """SELECT o.id FROM objects o
-               JOIN permissions p ON o.id = p.object_id
-               JOIN subjects s ON p.subject_id = s.id
-               WHERE o.name = ? AND s.name = ? AND p.own = 1""",
-            (object_name, subject_name)
-        )
-        if not cursor.fetchone():
+    @_writer
+    def delete_object_by_id(self, object_id, subject_id):
+        if not self._is_owner(subject_id, object_id):
             return False, "Нет прав на удаление объекта или объект не существует"
 
-        cursor.execute("DELETE FROM permissions WHERE object_id = (SELECT id FROM objects WHERE name = ?)",
-                       (object_name,))
-        cursor.execute("DELETE FROM objects WHERE name=?", (object_name,))
-        self.conn.commit()
+        object_name = self._object_names[object_id]
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM permissions WHERE object_id = ?", (object_id,))
+        cursor.execute("DELETE FROM objects WHERE id = ?", (object_id,))
+        del self._object_names[object_id]
+        del self._object_ids[object_name]
+        self._emit('delete_object', object_name, self._subject_names[subject_id])
+        self._commit()
         return True, f"Объект {object_name} удален"
 
-    def grant_right(self, grantor_name, recipient_name, object_name, right):
-        if right not in ['read', 'write', 'own']:
-            return False, "Некорректное право"
+    @_writer
+    def delete_objects(self, object_names, subject_name):
+        # Удаляет объекты, которыми владеет subject_name; если хотя бы на один
+        # объект у него нет права own, ничего не удаляется
+        object_names = list(dict.fromkeys(object_names))
+        subject_id = self._subject_ids.get(subject_name)
+        missing = [name for name in object_names if name not in self._object_ids]
+        if subject_id is None or missing:
+            return False, "Нет прав на удаление объектов или объекты не существуют"
 
         cursor = self.conn.cursor()
-
-        cursor.execute(
-            """SELECT 1 FROM permissions p
-               JOIN subjects s1 ON p.subject_id = s1.id
-               JOIN subjects s2 ON s2.name = ?
-               JOIN objects o ON p.object_id = o.id AND o.name = ?
-               WHERE s1.name = ? AND p.own = 1""",
-            (recipient_name, object_name, grantor_name)
-        )
-        if not cursor.fetchone():
-            return False, "Нет прав на передачу или субъект/объект не существует"
-
-        cursor.execute(
-            """SELECT 1 FROM permissions p
-               JOIN subjects s ON p.subject_id = s.id
-               JOIN objects o ON p.object_id = o.id
-               WHERE s.name = ? AND o.name = ?""",
-            (recipient_name, object_name)
-        )
-
-        if cursor.fetchone():
+        with self.transaction():
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS hru_deleted_objects (id INTEGER PRIMARY KEY)")
+            cursor.executemany(
+                "INSERT INTO hru_deleted_objects (id) VALUES (?)",
+                [(self._object_ids[name],) for name in object_names]
+            )
             cursor.execute(
-                f"""UPDATE permissions SET {right} = 1
-                    WHERE subject_id = (SELECT id FROM subjects WHERE name = ?)
-                    AND object_id = (SELECT id FROM objects WHERE name = ?)""",
-                (recipient_name, object_name)
+                """SELECT COUNT(*) FROM permissions
+                   WHERE subject_id = ? AND rights & ? != 0
+                     AND object_id IN (SELECT id FROM hru_deleted_objects)""",
+                (subject_id, self._own_bit)
             )
-        else:
+            if cursor.fetchone()[0] != len(object_names):
+                cursor.execute("DELETE FROM hru_deleted_objects")
+                return False, "Нет прав на удаление объектов или объекты не существуют"
+
+            cursor.execute("DELETE FROM permissions WHERE object_id IN (SELECT id FROM hru_deleted_objects)")
+            cursor.execute("DELETE FROM objects WHERE id IN (SELECT id FROM hru_deleted_objects)")
+            cursor.execute("DELETE FROM hru_deleted_objects")
+            for name in object_names:
+                del self._object_names[self._object_ids.pop(name)]
+                self._emit('delete_object', name, subject_name)
+        return True, f"Удалено объектов: {len(object_names)}"
+
+    def _cell_mask(self, subject_id, object_id):
+        if subject_id not in self._subject_names or object_id not in self._object_names:
+            return 0
+        with self._reader() as conn:
+            cursor = conn.cursor()
             cursor.execute(
-                f"""INSERT INTO permissions 
-                    (subject_id, object_id, {right})
-                    VALUES (
-                        (SELECT id FROM subjects WHERE name = ?),
-                        (SELECT id FROM objects WHERE name = ?),
-                        1
-                    )""",
-                (recipient_name, object_name)
+                "SELECT rights FROM permissions WHERE subject_id = ? AND object_id = ?",
+                (subject_id, object_id)
             )
+            row = cursor.fetchone()
+            return row[0] if row else 0
 
-        self.conn.commit()
-        return True, f"Право {right} на {object_name} передано от {grantor_name} к {recipient_name}"
+    def _is_owner(self, subject_id, object_id):
+        return bool(self._cell_mask(subject_id, object_id) & self._own_bit)
 
-    def revoke_right(self, revoker_name, target_name, object_name, right):
-        if right not in ['read', 'write', 'own']:
+    @staticmethod
+    def _rights_label(right):
+        return right if isinstance(right, str) else ', '.join(right)
+
+    @_writer
+    def grant_right(self, grantor_name, recipient_name, object_name, right):
+        return self.grant_right_by_id(
+            self._subject_ids.get(grantor_name),
+            self._subject_ids.get(recipient_name),
+            self._object_ids.get(object_name),
+            right
+        )
+
+    @_writer
+    def grant_right_by_id(self, grantor_id, recipient_id, object_id, right):
+        # right - имя права или набор имён; все права выдаются одним UPDATE
+        mask = self.rights_mask(right)
+        if mask is None:
             return False, "Некорректное право"
 
-        cursor = self.conn.cursor()
+        denied = (False, "Нет прав на передачу или субъект/объект не существует")
+        if (recipient_id not in self._subject_names or grantor_id not in self._subject_names
+                or object_id not in self._object_names):
+            return denied
 
+        # Проверка владения и запись - одна инструкция
+        cursor = self.conn.cursor()
         cursor.execute(
-            """SELECT 1 FROM permissions p
-               JOIN subjects s1 ON p.subject_id = s1.id
-               JOIN subjects s2 ON s2.name = ?
-               JOIN objects o ON p.object_id = o.id AND o.name = ?
-               WHERE s1.name = ? AND p.own = 1""",
-            (target_name, object_name, revoker_name)
+            """INSERT INTO permissions (subject_id, object_id, rights)
+               SELECT ?, ?, ? WHERE EXISTS (
+                   SELECT 1 FROM permissions WHERE subject_id = ? AND object_id = ? AND rights & ? != 0)
+               ON CONFLICT (subject_id, object_id) DO UPDATE SET rights = rights | excluded.rights""",
+            (recipient_id, object_id, mask, grantor_id, object_id, self._own_bit)
+        )
+        if not cursor.rowcount:
+            # INSERT без строк всё равно открыл транзакцию
+            self._commit()
+            return denied
+
+        grantor_name = self._subject_names[grantor_id]
+        recipient_name = self._subject_names[recipient_id]
+        object_name = self._object_names[object_id]
+        self._emit('grant_right', grantor_name, recipient_name, object_name, right)
+        if self._cell_listeners:
+            self._emit_cell(recipient_id, object_id)
+        self._commit()
+        return True, (f"Право {self._rights_label(right)} на {object_name} "
+                      f"передано от {grantor_name} к {recipient_name}")
+
+    @_writer
+    def revoke_right(self, revoker_name, target_name, object_name, right):
+        return self.revoke_right_by_id(
+            self._subject_ids.get(revoker_name),
+            self._subject_ids.get(target_name),
+            self._object_ids.get(object_name),
+            right
         )
-        if not cursor.fetchone():
+
+    @_writer
+    def revoke_right_by_id(self, revoker_id, target_id, object_id, right):
+        mask = self.rights_mask(right)
+        if mask is None:
+            return False, "Некорректное право"
+
+        if target_id not in self._subject_names or not self._is_owner(revoker_id, object_id):
             return False, "Нет прав на отзыв или субъект/объект не существует"
 
-        if right == 'own':
+        cursor = self.conn.cursor()
+        if mask & self._own_bit:
             cursor.execute(
-                """SELECT COUNT(*) FROM permissions p
-                   JOIN objects o ON p.object_id = o.id
-                   WHERE o.name = ? AND p.own = 1""",
-                (object_name,)
+                "SELECT COUNT(*) FROM permissions WHERE object_id = ? AND rights & ?",
+                (object_id, self._own_bit)
             )
             if cursor.fetchone()[0] <= 1:
                 return False, "Нельзя отозвать последнее право владения"
 
         cursor.execute(
-            f"""UPDATE permissions SET {right} = 0
-                WHERE subject_id = (SELECT id FROM subjects WHERE name = ?)
-                AND object_id = (SELECT id FROM objects WHERE name = ?)""",
-            (target_name, object_name)
+            "UPDATE permissions SET rights = rights & ~? WHERE subject_id = ? AND object_id = ?",
+            (mask, target_id, object_id)
         )
 
-        self.conn.commit()
-        return True, f"Право {right} на {object_name} отозвано у {target_name}"
+        target_name = self._subject_names[target_id]
+        object_name = self._object_names[object_id]
+        self._emit('revoke_right', self._subject_names[revoker_id], target_name, object_name, right)
+        if self._cell_listeners:
+            self._emit_cell(target_id, object_id)
+        self._commit()
+        return True, f"Право {self._rights_label(right)} на {object_name} отозвано у {target_name}"
 
     def get_subjects(self):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT name FROM subjects ORDER BY name")
-        return [row[0] for row in cursor.fetchall()]
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM subjects ORDER BY name")
+            return [row[0] for row in cursor.fetchall()]
 
     def get_objects(self):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT name FROM objects ORDER BY name")
-        return [row[0] for row in cursor.fetchall()]
-
-    def get_rights(self, subject_name=None, object_name=None):
-        cursor = self.conn.cursor()
-
-        if subject_name and object_name:
-            cursor.execute(
-                """SELECT p.read, p.write, p.own
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM objects ORDER BY name")
+            return [row[0] for row in cursor.fetchall()]
+
+    def search_subjects(self, prefix='', limit=100, after=None):
+        return self._search_names('subjects', prefix, limit, after)
+
+    def search_objects(self, prefix='', limit=100, after=None):
+        return self._search_names('objects', prefix, limit, after)
+
+    def _search_names(self, table, prefix, limit, after):
+        # Поиск по началу имени диапазоном по уникальному индексу name;
+        # after - последнее имя предыдущей страницы. Возвращает
+        # (имена, курсор следующей страницы или None)
+        conditions, params = [], []
+        if prefix:
+            conditions.append("name >= ?")
+            params.append(prefix)
+            end = _prefix_end(prefix)
+            if end is not None:
+                conditions.append("name < ?")
+                params.append(end)
+        if after is not None:
+            conditions.append("name > ?")
+            params.append(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._reader() as conn:
+            names = [row[0] for row in conn.execute(
+                f"SELECT name FROM {table} {where} ORDER BY name LIMIT ?", (*params, limit)
+            )]
+        return names, (names[-1] if len(names) == limit else None)
+
+    def check(self, subject_name, object_name, right):
+        bit = self.rights.get(right)
+        if bit is None:
+            return False
+        mask = self.cache.get(subject_name, object_name)
+        if mask is None:
+            token = self.cache.token(subject_name, object_name)
+            mask = self._cell_mask(self._subject_ids.get(subject_name), self._object_ids.get(object_name))
+            self.cache.put(subject_name, object_name, mask, token)
+        return bool(mask & bit)
+
+    def check_by_id(self, subject_id, object_id, right):
+        bit = self.rights.get(right)
+        if bit is None:
+            return False
+        return bool(self._cell_mask(subject_id, object_id) & bit)
+
+    def iter_cells(self):
+        with self._reader() as conn:
+            yield from conn.execute(
+                """SELECT s.name, o.name, p.rights
                    FROM permissions p
                    JOIN subjects s ON p.subject_id = s.id
-                   JOIN objects o ON p.object_id = o.id
-                   WHERE s.name = ? AND o.name = ?""",
-                (subject_name, object_name)
+                   JOIN objects o ON p.object_id = o.id"""
             )
-            result = cursor.fetchone()
-            if not result:
-                return None
-            return {
-                'read': bool(result[0]),
-                'write': bool(result[1]),
-                'own': bool(result[2])
-            }
-        elif subject_name:
+
+    def iter_cell_ids(self):
+        # Как iter_cells, но без JOIN: (subject_id, object_id, rights)
+        with self._reader() as conn:
+            yield from conn.execute("SELECT subject_id, object_id, rights FROM permissions")
+
+    def _match_sql(self, rights, match):
+        mask = self.rights_mask(rights)
+        if mask is None or match not in ('any', 'all'):
+            return None, None
+        if match == 'any':
+            return "rights & ? != 0", (mask,)
+        return "rights & ? = ?", (mask, mask)
+
+    def subjects_with_rights(self, object_name, rights, match='any'):
+        # Субъекты, у которых есть любое (any) или все (all) из прав на объект
+        object_id = self._object_ids.get(object_name)
+        predicate, params = self._match_sql(rights, match)
+        if object_id is None or predicate is None:
+            return []
+        with self._reader() as conn:
+            cursor = conn.cursor()
             cursor.execute(
-                """SELECT o.name, p.read, p.write, p.own
-                   FROM permissions p
-                   JOIN subjects s ON p.subject_id = s.id
-                   JOIN objects o ON p.object_id = o.id
-                   WHERE s.name = ?""",
-                (subject_name,)
+                f"SELECT subject_id FROM permissions WHERE object_id = ? AND {predicate}",
+                (object_id, *params)
             )
-            return [
-                {
-                    'object': row[0],
-                    'read': bool(row[1]),
-                    'write': bool(row[2]),
-                    'own': bool(row[3])
-                }
-                for row in cursor.fetchall()
-            ]
-        elif object_name:
+            return sorted(self._subject_names[row[0]] for row in cursor.fetchall()
+                          if row[0] in self._subject_names)
+
+    def objects_with_rights(self, subject_name, rights, match='any'):
+        subject_id = self._subject_ids.get(subject_name)
+        predicate, params = self._match_sql(rights, match)
+        if subject_id is None or predicate is None:
+            return []
+        with self._reader() as conn:
+            cursor = conn.cursor()
             cursor.execute(
-                """SELECT s.name, p.read, p.write, p.own
-                   FROM permissions p
-                   JOIN subjects s ON p.subject_id = s.id
-                   JOIN objects o ON p.object_id = o.id
-                   WHERE o.name = ?""",
-                (object_name,)
+                f"SELECT object_id FROM permissions WHERE subject_id = ? AND {predicate}",
+                (subject_id, *params)
             )
-            return [
-                {
-                    'subject': row[0],
-                    'read': bool(row[1]),
-                    'write': bool(row[2]),
-                    'own': bool(row[3])
-                }
-                for row in cursor.fetchall()
-            ]
+            return sorted(self._object_names[row[0]] for row in cursor.fetchall()
+                          if row[0] in self._object_names)
+
+    def get_rights(self, subject_name=None, object_name=None):
+        subject_id = self._subject_ids.get(subject_name)
+        object_id = self._object_ids.get(object_name)
+
+        if subject_name and object_name:
+            if subject_id is None or object_id is None:
+                return None
+            return self.get_rights_by_id(subject_id, object_id)
+        elif subject_name:
+            if subject_id is None:
+                return []
+            return self.get_rights_by_id(subject_id=subject_id)
+        elif object_name:
+            if object_id is None:
+                return []
+            return self.get_rights_by_id(object_id=object_id)
         else:
             return None
 
-    def display_rights(self, subject_name=None, object_name=None):
-        rights = self.get_rights(subject_name, object_name)
-        if rights is None:
+    def _rights_query(self, subject_name, object_name, rights, match):
+        # Строка (по субъекту) или столбец (по объекту) матрицы с ключом
+        # пагинации - id второй стороны ячейки
+        if subject_name is not None and object_name is None:
+            owner_id, kind, names = self._subject_ids.get(subject_name), 'o', self._object_names
+            sql = "SELECT object_id, rights FROM permissions WHERE subject_id = ? AND object_id > ?"
+            order = "object_id"
+        elif object_name is not None and subject_name is None:
+            owner_id, kind, names = self._object_ids.get(object_name), 's', self._subject_names
+            sql = "SELECT subject_id, rights FROM permissions WHERE object_id = ? AND subject_id > ?"
+            order = "subject_id"
+        else:
+            raise ValueError("Укажите либо субъект, либо объект")
+
+        params = ()
+        if rights is not None:
+            predicate, params = self._match_sql(rights, match)
+            if predicate is None:
+                raise ValueError("Некорректный фильтр прав")
+            sql += f" AND {predicate}"
+        return owner_id, kind, names, f"{sql} ORDER BY {order} LIMIT ?", params
+
+    def _rights_page(self, query, after, limit):
+        owner_id, kind, names, sql, params = query
+        with self._reader() as conn:
+            rows = conn.execute(sql, (owner_id, after, *params, limit)).fetchall()
+        key = 'object' if kind == 'o' else 'subject'
+        items = [
+            {key: names[peer_id], **self.mask_to_rights(mask)}
+            for peer_id, mask in rows
+            if peer_id in names
+        ]
+        return items, (rows[-1][0] if len(rows) == limit else None)
+
+    def iter_rights(self, subject_name=None, object_name=None, rights=None, match='any', page_size=1000):
+        # Потоковый вариант get_rights: строки читаются страницами, соединение
+        # читателя не удерживается между страницами
+        query = self._rights_query(subject_name, object_name, rights, match)
+        if query[0] is None:
+            return
+        after = 0
+        while after is not None:
+            items, after = self._rights_page(query, after, page_size)
+            yield from items
+
+    def get_rights_page(self, subject_name=None, object_name=None, rights=None, match='any',
+                        limit=100, cursor=None):
+        # Возвращает (элементы, курсор следующей страницы или None)
+        query = self._rights_query(subject_name, object_name, rights, match)
+        owner_id, kind = query[:2]
+        after = 0
+        if cursor is not None:
+            if not (cursor[:1] == kind and cursor[1:].isdigit()):
+                raise ValueError("Некорректный курсор")
+            after = int(cursor[1:])
+        if owner_id is None:
+            return [], None
+        items, last = self._rights_page(query, after, limit)
+        return items, (f"{kind}{last}" if last is not None else None)
+
+    def get_rights_by_id(self, subject_id=None, object_id=None):
+        with self._reader() as conn:
+            cursor = conn.cursor()
+
+            if subject_id is not None and object_id is not None:
+                cursor.execute(
+                    "SELECT rights FROM permissions WHERE subject_id = ? AND object_id = ?",
+                    (subject_id, object_id)
+                )
+                result = cursor.fetchone()
+                if not result:
+                    return None
+                return self.mask_to_rights(result[0])
+            elif subject_id is not None:
+                cursor.execute(
+                    "SELECT object_id, rights FROM permissions WHERE subject_id = ?",
+                    (subject_id,)
+                )
+                return [
+                    {'object': self._object_names[row[0]], **self.mask_to_rights(row[1])}
+                    for row in cursor.fetchall()
+                    if row[0] in self._object_names
+                ]
+            elif object_id is not None:
+                cursor.execute(
+                    "SELECT subject_id, rights FROM permissions WHERE object_id = ?",
+                    (object_id,)
+                )
+                return [
+                    {'subject': self._subject_names[row[0]], **self.mask_to_rights(row[1])}
+                    for row in cursor.fetchall()
+                    if row[0] in self._subject_names
+                ]
+            else:
+                return None
+
+    def display_rights(self, subject_name=None, object_name=None, rights=None):
+        if subject_name and object_name:
+            cell = self.get_rights(subject_name, object_name)
+            if cell is None:
+                print("Нет данных для отображения")
+                return
+        elif subject_name:
+            rows = self.iter_rights(subject_name=subject_name, rights=rights)
+        elif object_name:
+            rows = self.iter_rights(object_name=object_name, rights=rights)
+        else:
             print("Нет данных для отображения")
             return
 
+        labels = [RIGHT_LABELS.get(right, right) for right in self.rights]
+        row_format = "{:<20}" + " {:<10}" * len(labels)
+
         if subject_name and object_name:
             print(f"\nПрава субъекта {subject_name} на объект {object_name}:")
-            print(f"Чтение: {'Да' if rights['read'] else 'Нет'}")
-            print(f"Запись: {'Да' if rights['write'] else 'Нет'}")
-            print(f"Владение: {'Да' if rights['own'] else 'Нет'}")
+            for right, label in zip(self.rights, labels):
+                print(f"{label}: {'Да' if cell[right] else 'Нет'}")
         elif subject_name:
             print(f"\nВсе права субъекта {subject_name}:")
-            print("{:<20} {:<10} {:<10} {:<10}".format("Объект", "Чтение", "Запись", "Владение"))
-            for right in rights:
-                print("{:<20} {:<10} {:<10} {:<10}".format(
+            print(row_format.format("Объект", *labels))
+            for right in rows:
+                print(row_format.format(
                     right['object'],
-                    'Да' if right['read'] else 'Нет',
-                    'Да' if right['write'] else 'Нет',
-                    'Да' if right['own'] else 'Нет'
+                    *['Да' if right[name] else 'Нет' for name in self.rights]
                 ))
         elif object_name:
             print(f"\nВсе права на объект {object_name}:")
-            print("{:<20} {:<10} {:<10} {:<10}".format("Субъект", "Чтение", "Запись", "Владение"))
-            for right in rights:
-                print("{:<20} {:<10} {:<10} {:<10}".format(
+            print(row_format.format("Субъект", *labels))
+            for right in rows:
+                print(row_format.format(
                     right['subject'],
-                    'Да' if right['read'] else 'Нет',
-                    'Да' if right['write'] else 'Нет',
-                    'Да' if right['own'] else 'Нет'
+                    *['Да' if right[name] else 'Нет' for name in self.rights]
                 ))
 
+class Snapshot(HRUDatabase):
+    # Снимок из HRUDatabase.snapshot(): доступны все методы чтения базы,
+    # изменения запрещены. Словари имён и алфавит прав читаются из того же
+    # закреплённого состояния.
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.RLock()
+        self._listeners = []
+        self._cell_listeners = 0
+        self.cache = DecisionCache()
+        self.profiler = None
+        self._load_rights()
+        self._load_names()
+
+    @contextmanager
+    def _writing(self):
+        raise sqlite3.OperationalError("Снимок доступен только для чтения")
+        yield
+
+    @contextmanager
+    def _reader(self):
+        with self._lock:
+            yield self.conn
+
+    def snapshot(self):
+        return self
+
+    def close(self):
+        with self._lock:
+            self.conn.rollback()
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 class HRUConsole:
-    def __init__(self):
-        self.db = HRUDatabase()
+    # Списки выводятся страницами по page_size имён
+    page_size = 20
+
+    def __init__(self, path='hru_model.db'):
+        self.db = HRUDatabase(path)
         self.run()
 
     def display_menu(self):
@@ -315,6 +1475,7 @@ class HRUConsole:
         print("2. Управление объектами")
         print("3. Управление правами")
         print("4. Просмотр прав")
+        print("6. Статистика")
         print("5. Выход")
 
     def run(self):
@@ -333,9 +1494,94 @@ class HRUConsole:
             elif choice == '5':
                 print("Выход из программы")
                 break
+            elif choice == '6':
+                self.view_stats()
             else:
                 print("Неверный выбор. Попробуйте снова.")
 
+    def view_stats(self):
+        stats = self.db.stats()
+        if stats is None:
+            self.db.enable_stats(slow_ms=100)
+            print("Сбор статистики включён (медленные вызовы: от 100 мс)")
+            return
+
+        if not stats['methods']:
+            print("Статистика пока пуста")
+            return
+        row_format = "{:<24} {:>8} {:>12} {:>12} {:>8} {:>10}"
+        print(row_format.format("Метод", "Вызовы", "Среднее, мс", "Макс., мс", "SQL", "Строки"))
+        for name, method in stats['methods'].items():
+            print(row_format.format(
+                name, method['calls'], f"{method['mean_ms']:.3f}", f"{method['max_ms']:.3f}",
+                method['statements'], method['rows']
+            ))
+        for entry in stats['slow_queries']:
+            print(f"\nМедленный вызов {entry['method']}{entry['args']}: {entry['ms']:.1f} мс")
+            for statement in entry['statements']:
+                print(f"  {statement}")
+
+    def show_page(self, names, start, exclude=None):
+        for i, name in enumerate(names, start):
+            if name != exclude:
+                print(f"{i}. {name}")
+
+    def pick(self, search, prompt, exclude=None):
+        # Выбор из постраничного списка: номер выбирает строку текущей
+        # страницы, пустой ввод листает дальше, текст - точное имя или
+        # поиск по началу имени. Список целиком не загружается.
+        prefix, after, start = '', None, 1
+        while True:
+            names, cursor = search(prefix, self.page_size, after)
+            if not names and prefix:
+                print("Ничего не найдено")
+                prefix, after, start = '', None, 1
+                continue
+            self.show_page(names, start, exclude)
+            if cursor is not None or prefix:
+                print("Enter - следующая страница, текст - имя или начало имени")
+
+            answer = input(prompt).strip()
+            if answer.isdigit():
+                index = int(answer) - start
+                if 0 <= index < len(names) and names[index] != exclude:
+                    return names[index]
+                print("Неверный номер")
+                return None
+            if not answer:
+                # После последней страницы список начинается сначала
+                after, start = (cursor, start + len(names)) if cursor else (None, 1)
+                continue
+            if answer != exclude and search(answer, 1)[0] == [answer]:
+                return answer
+            prefix, after, start = answer, None, 1
+
+    def pick_subject(self, prompt, exclude=None):
+        return self.pick(self.db.search_subjects, prompt, exclude)
+
+    def pick_object(self, prompt):
+        return self.pick(self.db.search_objects, prompt)
+
+    def browse(self, search, title, empty):
+        prefix, after, start = '', None, 1
+        while True:
+            names, cursor = search(prefix, self.page_size, after)
+            if not names:
+                print(empty)
+                return
+            if start == 1:
+                print(f"\n{title}")
+            self.show_page(names, start)
+            if cursor is None:
+                return
+            answer = input("Enter - следующая страница, текст - поиск, 0 - назад: ").strip()
+            if answer == '0':
+                return
+            if answer:
+                prefix, after, start = answer, None, 1
+            else:
+                after, start = cursor, start + len(names)
+
     def manage_subjects(self):
         while True:
             print("\nУправление субъектами:")
@@ -354,32 +1600,17 @@ class HRUConsole:
                 else:
                     print("Имя субъекта не может быть пустым")
             elif choice == '2':
-                subjects = self.db.get_subjects()
-                if not subjects:
+                if not self.db.search_subjects(limit=1)[0]:
                     print("Нет субъектов для удаления")
                     continue
 
                 print("Доступные субъекты:")
-                for i, subject in enumerate(subjects, 1):
-                    print(f"{i}. {subject}")
-
-                try:
-                    num = int(input("Выберите номер субъекта для удаления: "))
-                    if 1 <= num <= len(subjects):
-                        success, message = self.db.delete_subject(subjects[num-1])
-                        print(message)
-                    else:
-                        print("Неверный номер")
-                except ValueError:
-                    print("Введите число")
+                subject = self.pick_subject("Выберите номер субъекта для удаления: ")
+                if subject is not None:
+                    success, message = self.db.delete_subject(subject)
+                    print(message)
             elif choice == '3':
-                subjects = self.db.get_subjects()
-                if subjects:
-                    print("\nСписок субъектов:")
-                    for subject in subjects:
-                        print(subject)
-                else:
-                    print("Нет субъектов")
+                self.browse(self.db.search_subjects, "Список субъектов:", "Нет субъектов")
             elif choice == '4':
                 break
             else:
@@ -401,62 +1632,32 @@ class HRUConsole:
                     print("Имя объекта не может быть пустым")
                     continue
 
-                subjects = self.db.get_subjects()
-                if not subjects:
+                if not self.db.search_subjects(limit=1)[0]:
                     print("Нет субъектов. Сначала создайте хотя бы одного субъекта.")
                     continue
 
                 print("Доступные владельцы:")
-                for i, subject in enumerate(subjects, 1):
-                    print(f"{i}. {subject}")
-
-                try:
-                    num = int(input("Выберите номер владельца: "))
-                    if 1 <= num <= len(subjects):
-                        success, message = self.db.create_object(name, subjects[num-1])
-                        print(message)
-                    else:
-                        print("Неверный номер")
-                except ValueError:
-                    print("Введите число")
+                owner = self.pick_subject("Выберите номер владельца: ")
+                if owner is not None:
+                    success, message = self.db.create_object(name, owner)
+                    print(message)
             elif choice == '2':
-                objects = self.db.get_objects()
-                if not objects:
+                if not self.db.search_objects(limit=1)[0]:
                     print("Нет объектов для удаления")
                     continue
 
                 print("Доступные объекты:")
-                for i, obj in enumerate(objects, 1):
-                    print(f"{i}. {obj}")
+                object_name = self.pick_object("Выберите номер объекта для удаления: ")
+                if object_name is None:
+                    continue
 
-                try:
-                    num = int(input("Выберите номер объекта для удаления: "))
-                    if not (1 <= num <= len(objects)):
-                        print("Неверный номер")
-                        continue
-
-                    object_name = objects[num-1]
-                    subjects = self.db.get_subjects()
-                    print("Доступные субъекты для удаления:")
-                    for i, subject in enumerate(subjects, 1):
-                        print(f"{i}. {subject}")
-
-                    num_subj = int(input("Выберите номер субъекта, который удаляет объект: "))
-                    if 1 <= num_subj <= len(subjects):
-                        success, message = self.db.delete_object(object_name, subjects[num_subj-1])
-                        print(message)
-                    else:
-                        print("Неверный номер")
-                except ValueError:
-                    print("Введите число")
+                print("Доступные субъекты для удаления:")
+                subject = self.pick_subject("Выберите номер субъекта, который удаляет объект: ")
+                if subject is not None:
+                    success, message = self.db.delete_object(object_name, subject)
+                    print(message)
             elif choice == '3':
-                objects = self.db.get_objects()
-                if objects:
-                    print("\nСписок объектов:")
-                    for obj in objects:
-                        print(obj)
-                else:
-                    print("Нет объектов")
+                self.browse(self.db.search_objects, "Список объектов:", "Нет объектов")
             elif choice == '4':
                 break
             else:
@@ -480,131 +1681,90 @@ class HRUConsole:
             else:
                 print("Неверный выбор")
 
+    def choose_right(self):
+        rights = list(self.db.rights)
+        for i, right in enumerate(rights, 1):
+            label = RIGHT_LABELS.get(right)
+            print(f"{i}. {label} ({right})" if label else f"{i}. {right}")
+
+        num_right = int(input("Номер права: "))
+        if 1 <= num_right <= len(rights):
+            return rights[num_right-1]
+        return None
+
+    def choose_cell(self, owner_title, target_title, target_prompt):
+        # Владелец, второй субъект и объект для передачи или отзыва права
+        print(owner_title)
+        owner = self.pick_subject("Номер владельца: ")
+        if owner is None:
+            return None
+
+        print(target_title)
+        target = self.pick_subject(target_prompt, exclude=owner)
+        if target is None:
+            return None
+
+        print("Выберите объект:")
+        object_name = self.pick_object("Номер объекта: ")
+        if object_name is None:
+            return None
+        return owner, target, object_name
+
     def grant_right(self):
-        subjects = self.db.get_subjects()
-        if len(subjects) < 2:
+        if len(self.db.search_subjects(limit=2)[0]) < 2:
             print("Нужно как минимум 2 субъекта для передачи прав")
             return
 
-        objects = self.db.get_objects()
-        if not objects:
+        if not self.db.search_objects(limit=1)[0]:
             print("Нет объектов для управления правами")
             return
 
-        print("Выберите владельца, который передает право:")
-        for i, subject in enumerate(subjects, 1):
-            print(f"{i}. {subject}")
+        cell = self.choose_cell(
+            "Выберите владельца, который передает право:",
+            "Выберите получателя права:",
+            "Номер получателя: ",
+        )
+        if cell is None:
+            return
 
         try:
-            num_grantor = int(input("Номер владельца: "))
-            if not (1 <= num_grantor <= len(subjects)):
-                print("Неверный номер")
-                return
-
-            print("Выберите получателя права:")
-            for i, subject in enumerate(subjects, 1):
-                if i != num_grantor:
-                    print(f"{i}. {subject}")
-
-            num_recipient = int(input("Номер получателя: "))
-            if not (1 <= num_recipient <= len(subjects)) or num_recipient == num_grantor:
-                print("Неверный номер")
-                return
-
-            print("Выберите объект:")
-            for i, obj in enumerate(objects, 1):
-                print(f"{i}. {obj}")
-
-            num_object = int(input("Номер объекта: "))
-            if not (1 <= num_object <= len(objects)):
-                print("Неверный номер")
-                return
-
             print("Выберите право:")
-            print("1. Чтение (read)")
-            print("2. Запись (write)")
-            print("3. Владение (own)")
-
-            num_right = int(input("Номер права: "))
-            if num_right == 1:
-                right = 'read'
-            elif num_right == 2:
-                right = 'write'
-            elif num_right == 3:
-                right = 'own'
-            else:
+            right = self.choose_right()
+            if right is None:
                 print("Неверный номер")
                 return
 
-            grantor = subjects[num_grantor-1]
-            recipient = subjects[num_recipient-1]
-            object_name = objects[num_object-1]
-
+            grantor, recipient, object_name = cell
             success, message = self.db.grant_right(grantor, recipient, object_name, right)
             print(message)
         except ValueError:
             print("Введите число")
 
     def revoke_right(self):
-        subjects = self.db.get_subjects()
-        if len(subjects) < 2:
+        if len(self.db.search_subjects(limit=2)[0]) < 2:
             print("Нужно как минимум 2 субъекта для отзыва прав")
             return
 
-        objects = self.db.get_objects()
-        if not objects:
+        if not self.db.search_objects(limit=1)[0]:
             print("Нет объектов для управления правами")
             return
 
-        print("Выберите владельца, который отзывает право:")
-        for i, subject in enumerate(subjects, 1):
-            print(f"{i}. {subject}")
+        cell = self.choose_cell(
+            "Выберите владельца, который отзывает право:",
+            "Выберите субъекта, у которого отзывается право:",
+            "Номер субъекта: ",
+        )
+        if cell is None:
+            return
 
         try:
-            num_revoker = int(input("Номер владельца: "))
-            if not (1 <= num_revoker <= len(subjects)):
-                print("Неверный номер")
-                return
-
-            print("Выберите субъекта, у которого отзывается право:")
-            for i, subject in enumerate(subjects, 1):
-                if i != num_revoker:
-                    print(f"{i}. {subject}")
-
-            num_target = int(input("Номер субъекта: "))
-            if not (1 <= num_target <= len(subjects)) or num_target == num_revoker:
-                print("Неверный номер")
-                return
-
-            print("Выберите объект:")
-            for i, obj in enumerate(objects, 1):
-                print(f"{i}. {obj}")
-
-            num_object = int(input("Номер объекта: "))
-            if not (1 <= num_object <= len(objects)):
-                print("Неверный номер")
-                return
-
             print("Выберите право для отзыва:")
-            print("1. Чтение (read)")
-            print("2. Запись (write)")
-            print("3. Владение (own)")
-
-            num_right = int(input("Номер права: "))
-            if num_right == 1:
-                right = 'read'
-            elif num_right == 2:
-                right = 'write'
-            elif num_right == 3:
-                right = 'own'
-            else:
+            right = self.choose_right()
+            if right is None:
                 print("Неверный номер")
                 return
 
-            revoker = subjects[num_revoker-1]
-            target = subjects[num_target-1]
-            object_name = objects[num_object-1]
-
+            revoker, target, object_name = cell
             success, message = self.db.revoke_right(revoker, target, object_name, right)
             print(message)
         except ValueError:
@@ -621,77 +1781,157 @@ class HRUConsole:
             choice = input("Выберите действие: ")
 
             if choice == '1':
-                subjects = self.db.get_subjects()
-                if not subjects:
+                if not self.db.search_subjects(limit=1)[0]:
                     print("Нет субъектов")
                     continue
 
                 print("Выберите субъект:")
-                for i, subject in enumerate(subjects, 1):
-                    print(f"{i}. {subject}")
-
-                try:
-                    num = int(input("Номер субъекта: "))
-                    if 1 <= num <= len(subjects):
-                        self.db.display_rights(subject_name=subjects[num-1])
-                    else:
-                        print("Неверный номер")
-                except ValueError:
-                    print("Введите число")
+                subject = self.pick_subject("Номер субъекта: ")
+                if subject is not None:
+                    self.db.display_rights(subject_name=subject)
             elif choice == '2':
-                objects = self.db.get_objects()
-                if not objects:
+                if not self.db.search_objects(limit=1)[0]:
                     print("Нет объектов")
                     continue
 
                 print("Выберите объект:")
-                for i, obj in enumerate(objects, 1):
-                    print(f"{i}. {obj}")
-
-                try:
-                    num = int(input("Номер объекта: "))
-                    if 1 <= num <= len(objects):
-                        self.db.display_rights(object_name=objects[num-1])
-                    else:
-                        print("Неверный номер")
-                except ValueError:
-                    print("Введите число")
+                object_name = self.pick_object("Номер объекта: ")
+                if object_name is not None:
+                    self.db.display_rights(object_name=object_name)
             elif choice == '3':
-                subjects = self.db.get_subjects()
-                if not subjects:
+                if not self.db.search_subjects(limit=1)[0]:
                     print("Нет субъектов")
                     continue
 
-                objects = self.db.get_objects()
-                if not objects:
+                if not self.db.search_objects(limit=1)[0]:
                     print("Нет объектов")
                     continue
 
                 print("Выберите субъект:")
-                for i, subject in enumerate(subjects, 1):
-                    print(f"{i}. {subject}")
-
-                num_subj = int(input("Номер субъекта: "))
-                if not (1 <= num_subj <= len(subjects)):
-                    print("Неверный номер")
+                subject = self.pick_subject("Номер субъекта: ")
+                if subject is None:
                     continue
 
                 print("Выберите объект:")
-                for i, obj in enumerate(objects, 1):
-                    print(f"{i}. {obj}")
-
-                num_obj = int(input("Номер объекта: "))
-                if 1 <= num_obj <= len(objects):
-                    self.db.display_rights(
-                        subject_name=subjects[num_subj-1],
-                        object_name=objects[num_obj-1]
-                    )
-                else:
-                    print("Неверный номер")
+                object_name = self.pick_object("Номер объекта: ")
+                if object_name is not None:
+                    self.db.display_rights(subject_name=subject, object_name=object_name)
             elif choice == '4':
                 break
             else:
                 print("Неверный выбор")
 
+SCRIPT_COMMANDS = BATCH_COMMANDS + ('register_right',)
+
+# Число аргументов каждой команды сценария
+SCRIPT_ARITY = {
+    'create_subject': 1, 'delete_subject': 1,
+    'create_object': 2, 'delete_object': 2,
+    'grant_right': 4, 'revoke_right': 4,
+    'register_right': 1,
+}
+
+
+def parse_command(line):
+    # Строка сценария: "grant_right admin user1 file1 read,write".
+    # Пустые строки и комментарии (#) дают None.
+    words = shlex.split(line, comments=True)
+    if not words:
+        return None
+    arity = SCRIPT_ARITY.get(words[0])
+    if arity is not None and len(words) - 1 != arity:
+        raise ValueError(f"{words[0]} ожидает аргументов: {arity}, получено: {len(words) - 1}")
+    if words[0] in ('grant_right', 'revoke_right') and len(words) == 5 and ',' in words[4]:
+        words[4] = words[4].split(',')
+    return tuple(words)
+
+
+def run_script(db, lines, batch_size=10000, atomic=False):
+    # Команды выполняются пакетами по batch_size, каждый пакет - одна
+    # транзакция; при atomic=True ошибка откатывает весь свой пакет
+    summary = {'total': 0, 'succeeded': 0, 'failed': 0, 'errors': []}
+    started = time.perf_counter()
+    batch = []
+
+    def flush():
+        results = db.apply([command for _, command in batch], atomic=atomic)
+        for (number, _), (success, message) in zip(batch, results):
+            if success:
+                summary['succeeded'] += 1
+            else:
+                summary['failed'] += 1
+                summary['errors'].append((number, message))
+        batch.clear()
+
+    for number, line in enumerate(lines, 1):
+        try:
+            command = parse_command(line)
+        except ValueError as error:
+            summary['total'] += 1
+            summary['failed'] += 1
+            summary['errors'].append((number, f"Ошибка разбора: {error}"))
+            continue
+        if command is None:
+            continue
+        summary['total'] += 1
+        if command[0] not in SCRIPT_COMMANDS:
+            summary['failed'] += 1
+            summary['errors'].append((number, f"Неизвестная команда {command[0]}"))
+            continue
+        if command[0] == 'register_right':
+            # Регистрация права меняет алфавит, поэтому выполняется отдельно
+            if batch:
+                flush()
+            success, message = db.register_right(*command[1:])
+            summary['succeeded' if success else 'failed'] += 1
+            if not success:
+                summary['errors'].append((number, message))
+            continue
+        batch.append((number, command))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    summary['seconds'] = time.perf_counter() - started
+    return summary
+
+
+def print_summary(summary, limit=20):
+    seconds = summary['seconds']
+    rate = summary['total'] / seconds if seconds else 0.0
+    print(f"Команд: {summary['total']}, успешно: {summary['succeeded']}, с ошибкой: {summary['failed']}")
+    print(f"Время: {seconds:.2f} с ({rate:.0f} команд/с)")
+    for number, message in summary['errors'][:limit]:
+        print(f"Строка {number}: {message}")
+    if len(summary['errors']) > limit:
+        print(f"...и ещё {len(summary['errors']) - limit} ошибок")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HRU модель")
+    parser.add_argument('--db', default='hru_model.db', help="путь к базе данных")
+    parser.add_argument('--script', help="файл сценария, '-' - стандартный ввод; без него запускается меню")
+    parser.add_argument('--batch-size', type=int, default=10000, help="команд в одной транзакции")
+    parser.add_argument('--atomic', action='store_true', help="ошибка откатывает весь пакет")
+    args = parser.parse_args(argv)
+
+    if args.script is None:
+        HRUConsole(args.db)
+        return
+
+    db = HRUDatabase(args.db)
+    try:
+        if args.script == '-':
+            summary = run_script(db, sys.stdin, args.batch_size, args.atomic)
+        else:
+            with open(args.script, encoding='utf-8') as file:
+                summary = run_script(db, file, args.batch_size, args.atomic)
+    finally:
+        db.close()
+    print_summary(summary)
+    return summary
+
+
 if __name__ == '__main__':
-    HRUConsole()
\ No newline at end of file
+    main()
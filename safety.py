@@ -0,0 +1,395 @@
+import hashlib
+import multiprocessing
+import os
+import pickle
+import queue
+import time
+import traceback
+from collections import deque
+
+from commands import default_commands
+
+
+class State:
+    # Состояние матрицы доступа: субъекты, объекты и тройки (s, o, право).
+    # fresh - имена сущностей, созданных при переборе; они взаимозаменяемы
+    # и при построении канонического ключа переименовываются.
+    __slots__ = ('subjects', 'objects', 'cells', 'fresh', 'counter')
+
+    def __init__(self, subjects, objects, cells, fresh=frozenset(), counter=0):
+        self.subjects = frozenset(subjects)
+        self.objects = frozenset(objects)
+        self.cells = frozenset(cells)
+        self.fresh = frozenset(fresh)
+        self.counter = counter
+
+    @classmethod
+    def from_db(cls, db):
+        cells = set()
+        for subject_name, object_name, mask in db.iter_cells():
+            for right, bit in db.rights.items():
+                if mask & bit:
+                    cells.add((subject_name, object_name, right))
+        return cls(db.get_subjects(), db.get_objects(), cells)
+
+    def has(self, subject, obj, right):
+        return (subject, obj, right) in self.cells
+
+    def key(self):
+        if not self.fresh:
+            return self.subjects, self.objects, self.cells
+
+        fresh = self.fresh
+
+        def label(name):
+            return (0, '') if name in fresh else (1, name)
+
+        signatures = {name: [] for name in fresh}
+        for s, o, r in self.cells:
+            if s in fresh:
+                signatures[s].append((label(o), r))
+            if o in fresh:
+                signatures[o].append((label(s), r))
+
+        mapping = {}
+        for kind, names in (('s', self.subjects), ('o', self.objects)):
+            ranked = sorted((sorted(signatures[name]), name) for name in names if name in fresh)
+            for i, (_, name) in enumerate(ranked, 1):
+                mapping[name] = f"<{kind}{i}>"
+
+        def rename(name):
+            return mapping.get(name, name)
+
+        return (
+            frozenset(map(rename, self.subjects)),
+            frozenset(map(rename, self.objects)),
+            frozenset((rename(s), rename(o), r) for s, o, r in self.cells),
+        )
+
+
+def new_name(kind, counter, subjects, objects):
+    while True:
+        counter += 1
+        name = f"<{kind[0]}{counter}>"
+        if name not in subjects and name not in objects:
+            return name, counter
+
+
+class SafetyResult:
+    def __init__(self, leaked, witness, states, depth, truncated, elapsed, workers=None):
+        self.leaked = leaked
+        self.witness = witness
+        self.states = states
+        self.depth = depth
+        self.truncated = truncated
+        self.elapsed = elapsed
+        self.workers = workers or []
+
+    def __repr__(self):
+        return (f"SafetyResult(leaked={self.leaked}, states={self.states}, "
+                f"depth={self.depth}, truncated={self.truncated})")
+
+
+def bindings(command, state):
+    params = [param for param in command.params if param not in command.created]
+    domains = {
+        'subject': sorted(state.subjects),
+        'object': sorted(state.objects),
+    }
+    # Условие проверяется, как только связаны все его параметры
+    checks = {param: [] for param in params}
+    bound_order = {param: i for i, param in enumerate(params)}
+    for condition in command.conditions:
+        if condition.subject not in bound_order or condition.obj not in bound_order:
+            return iter(())
+        last = max((condition.subject, condition.obj), key=bound_order.__getitem__)
+        checks[last].append(condition)
+
+    binding = {}
+
+    def extend(i):
+        if i == len(params):
+            yield dict(binding)
+            return
+        param = params[i]
+        for value in domains[command.kinds.get(param, 'subject')]:
+            binding[param] = value
+            if all(state.has(binding[c.subject], binding[c.obj], c.right) for c in checks[param]):
+                yield from extend(i + 1)
+        binding.pop(param, None)
+
+    return extend(0)
+
+
+def execute(command, binding, state):
+    subjects = set(state.subjects)
+    objects = set(state.objects)
+    cells = set(state.cells)
+    fresh = set(state.fresh)
+    counter = state.counter
+    binding = dict(binding)
+
+    for op in command.operations:
+        if op.kind == 'create_subject':
+            name, counter = new_name('subject', counter, subjects, objects)
+            binding[op.subject] = name
+            subjects.add(name)
+            fresh.add(name)
+        elif op.kind == 'create_object':
+            name, counter = new_name('object', counter, subjects, objects)
+            binding[op.obj] = name
+            objects.add(name)
+            fresh.add(name)
+        elif op.kind in ('enter', 'delete'):
+            s, o = binding[op.subject], binding[op.obj]
+            if s not in subjects or o not in objects:
+                return None, binding
+            if op.kind == 'enter':
+                cells.add((s, o, op.right))
+            else:
+                cells.discard((s, o, op.right))
+        elif op.kind == 'destroy_subject':
+            s = binding[op.subject]
+            if s not in subjects:
+                return None, binding
+            subjects.discard(s)
+            fresh.discard(s)
+            cells = {cell for cell in cells if cell[0] != s}
+        elif op.kind == 'destroy_object':
+            o = binding[op.obj]
+            if o not in objects:
+                return None, binding
+            objects.discard(o)
+            fresh.discard(o)
+            cells = {cell for cell in cells if cell[1] != o}
+
+    return State(subjects, objects, cells, fresh, counter), binding
+
+
+class SafetyAnalyzer:
+    # Поиск в ширину по достижимым состояниям для вопроса безопасности HRU:
+    # может ли субъект получить право на объект. Условия команд позитивны,
+    # поэтому команды, которые только удаляют права или сущности, не
+    # расширяют множество достижимых утечек и отбрасываются (монотонность).
+    def __init__(self, commands=None, max_depth=4, max_states=100000):
+        self.commands = list(commands if commands is not None else default_commands())
+        self.max_depth = max_depth
+        self.max_states = max_states
+        self.active = [command for command in self.commands if not command.removes_only]
+
+    def leak_test(self, initial, subject, obj, right):
+        if subject is not None and obj is not None:
+            return lambda state: (subject, obj, right) in state.cells
+
+        def leaked(state):
+            return any(
+                r == right and (subject is None or s == subject) and (obj is None or o == obj)
+                and (s, o, r) not in initial.cells
+                for s, o, r in state.cells
+            )
+        return leaked
+
+    def successors(self, state):
+        for command in self.active:
+            for binding in bindings(command, state):
+                new_state, full_binding = execute(command, binding, state)
+                if new_state is not None:
+                    yield new_state, (command.name, tuple(full_binding[param] for param in command.params))
+
+    def analyze(self, state, subject=None, obj=None, right='own'):
+        started = time.perf_counter()
+        if not isinstance(state, State):
+            state = State.from_db(state)
+        leaked = self.leak_test(state, subject, obj, right)
+
+        if leaked(state):
+            return SafetyResult(True, [], 1, 0, False, time.perf_counter() - started)
+
+        visited = {state.key()}
+        frontier = deque([(state, None, 0)])
+        depth = 0
+        truncated = False
+
+        while frontier:
+            current, path, depth = frontier.popleft()
+            if depth >= self.max_depth:
+                continue
+            for new_state, step in self.successors(current):
+                key = new_state.key()
+                if key in visited:
+                    continue
+                node = (step, path)
+                if leaked(new_state):
+                    return SafetyResult(True, unwind(node), len(visited) + 1, depth + 1,
+                                        False, time.perf_counter() - started)
+                if len(visited) >= self.max_states:
+                    truncated = True
+                    break
+                visited.add(key)
+                frontier.append((new_state, node, depth + 1))
+            if truncated:
+                break
+
+        return SafetyResult(False, [], len(visited), depth, truncated, time.perf_counter() - started)
+
+
+def unwind(node):
+    steps = []
+    while node is not None:
+        step, node = node
+        steps.append(step)
+    return steps[::-1]
+
+
+def can_leak(db, subject, obj, right, commands=None, **limits):
+    return SafetyAnalyzer(commands, **limits).analyze(db, subject, obj, right)
+
+
+def partition(key, parts):
+    # Стабильный между процессами хеш (hash() строк зависит от PYTHONHASHSEED)
+    subjects, objects, cells = key
+    data = repr((sorted(subjects), sorted(objects), sorted(cells))).encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big') % parts
+
+
+def _worker(index, parts, analyzer, initial, query, found, inbox, outbox):
+    # Ответ сериализуется здесь же: ошибка pickle в фоновом потоке очереди
+    # потеряла бы сообщение, и главный процесс ждал бы его вечно
+    try:
+        _expand(index, parts, analyzer, initial, query, found, inbox, outbox)
+    except BaseException:
+        outbox.put(pickle.dumps((index, None, traceback.format_exc())))
+
+
+def _expand(index, parts, analyzer, initial, query, found, inbox, outbox):
+    leaked = analyzer.leak_test(initial, *query)
+    visited = set()
+    expanded = 0
+    busy = 0.0
+
+    while True:
+        message = inbox.get()
+        if message is None:
+            return
+        items, depth = message
+        started = time.perf_counter()
+        outgoing = [[] for _ in range(parts)]
+        leak = None
+
+        for state, path in items:
+            if found.is_set():
+                break
+            key = state.key()
+            if key in visited:
+                continue
+            visited.add(key)
+            if depth >= analyzer.max_depth:
+                continue
+            expanded += 1
+            for new_state, step in analyzer.successors(state):
+                node = (step, path)
+                if leaked(new_state):
+                    leak = unwind(node)
+                    found.set()
+                    break
+                outgoing[partition(new_state.key(), parts)].append((new_state, node))
+            if leak is not None:
+                break
+
+        busy += time.perf_counter() - started
+        outbox.put(pickle.dumps((index, (outgoing, leak, len(visited), expanded, busy), None)))
+
+
+def _receive(outbox, processes, poll=0.5):
+    # Ожидание ответа с проверкой, что процессы живы
+    while True:
+        try:
+            index, result, error = pickle.loads(outbox.get(timeout=poll))
+        except queue.Empty:
+            for i, process in enumerate(processes):
+                if not process.is_alive():
+                    raise RuntimeError(f"Процесс анализа {i} завершился с кодом {process.exitcode}")
+            continue
+        if error is not None:
+            raise RuntimeError(f"Ошибка в процессе анализа {index}:\n{error}")
+        return index, result
+
+
+class ParallelSafetyAnalyzer(SafetyAnalyzer):
+    # Поуровневый обход в ширину на пуле процессов. Каждое состояние
+    # принадлежит процессу по хешу канонического ключа, поэтому множество
+    # посещённых состояний разбито между процессами без пересечений.
+    def __init__(self, commands=None, max_depth=4, max_states=100000, workers=None):
+        super().__init__(commands, max_depth, max_states)
+        self.workers = workers or os.cpu_count() or 1
+
+    def analyze(self, state, subject=None, obj=None, right='own'):
+        started = time.perf_counter()
+        if not isinstance(state, State):
+            state = State.from_db(state)
+        if self.leak_test(state, subject, obj, right)(state):
+            return SafetyResult(True, [], 1, 0, False, time.perf_counter() - started)
+
+        parts = self.workers
+        context = multiprocessing.get_context()
+        found = context.Event()
+        outbox = context.Queue()
+        inboxes = [context.Queue() for _ in range(parts)]
+        processes = [
+            context.Process(
+                target=_worker,
+                args=(i, parts, self, state, (subject, obj, right), found, inboxes[i], outbox),
+                daemon=True,
+            )
+            for i in range(parts)
+        ]
+        for process in processes:
+            process.start()
+
+        frontier = [[] for _ in range(parts)]
+        frontier[partition(state.key(), parts)].append((state, None))
+        stats = [(0, 0, 0.0)] * parts
+        depth = 0
+        leak = None
+        truncated = False
+
+        try:
+            while any(frontier):
+                for i in range(parts):
+                    inboxes[i].put((frontier[i], depth))
+                frontier = [[] for _ in range(parts)]
+                for _ in range(parts):
+                    index, (outgoing, worker_leak, visited, expanded, busy) = _receive(outbox, processes)
+                    stats[index] = (visited, expanded, busy)
+                    if worker_leak is not None and leak is None:
+                        leak = worker_leak
+                    for target, items in enumerate(outgoing):
+                        frontier[target].extend(items)
+                if leak is not None:
+                    break
+                if sum(visited for visited, _, _ in stats) >= self.max_states:
+                    truncated = any(frontier)
+                    break
+                depth += 1
+        finally:
+            for inbox in inboxes:
+                inbox.put(None)
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+
+        workers = [
+            {
+                'worker': i,
+                'states': expanded,
+                'seconds': busy,
+                'states_per_second': expanded / busy if busy else 0.0,
+            }
+            for i, (_, expanded, busy) in enumerate(stats)
+        ]
+        return SafetyResult(
+            leak is not None, leak or [], sum(visited for visited, _, _ in stats),
+            depth + 1 if leak is not None else min(depth, self.max_depth), truncated,
+            time.perf_counter() - started, workers,
+        )
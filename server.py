@@ -0,0 +1,198 @@
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from model import HRUDatabase
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+class LatencyRecorder:
+    # Последние window измерений на каждую точку входа
+    def __init__(self, window=10000):
+        self.window = window
+        self._samples = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds):
+        with self._lock:
+            self._samples.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+            self._counts[endpoint] = self._counts.get(endpoint, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            samples = {endpoint: sorted(values) for endpoint, values in self._samples.items()}
+            counts = dict(self._counts)
+        return {
+            endpoint: {
+                'count': counts[endpoint],
+                'p50_ms': percentile(values, 50) * 1000,
+                'p90_ms': percentile(values, 90) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'max_ms': values[-1] * 1000,
+            }
+            for endpoint, values in samples.items()
+        }
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _arguments(item, fields, lists=()):
+    if isinstance(item, dict):
+        try:
+            values = [item[field] for field in fields]
+        except KeyError as error:
+            raise BadRequest(f"Не указано поле {error.args[0]}")
+    elif isinstance(item, list) and len(item) == len(fields):
+        values = item
+    else:
+        raise BadRequest(f"Ожидается объект с полями {', '.join(fields)}")
+
+    # Значения - строки; поля из lists могут быть и непустым списком строк
+    for field, value in zip(fields, values):
+        if field in lists and isinstance(value, list) and value:
+            valid = all(isinstance(right, str) for right in value)
+        else:
+            valid = isinstance(value, str)
+        if not valid:
+            raise BadRequest(f"Некорректное значение поля {field}")
+    return values
+
+
+def _batch(payload):
+    items = payload.get('requests') if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        raise BadRequest("Ожидается список запросов")
+    return items
+
+
+class DecisionHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1: соединение остаётся открытым между запросами клиента
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _content_length(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # Границу тела не определить: соединение закрывается после ответа
+            self.close_connection = True
+            raise BadRequest("Некорректный Content-Length")
+        return length
+
+    def _read_json(self):
+        length = self._content_length()
+        try:
+            return json.loads(self.rfile.read(length) or b'null')
+        except ValueError:
+            raise BadRequest("Некорректный JSON")
+
+    def _handle(self, endpoint, handler):
+        started = time.perf_counter()
+        try:
+            status, payload = 200, handler()
+        except BadRequest as error:
+            status, payload = 400, {'error': str(error)}
+        except Exception as error:
+            # Клиент с keep-alive должен получить ответ, а не обрыв соединения
+            self.log_error("%s: %r", endpoint, error)
+            status, payload = 500, {'error': "Внутренняя ошибка сервера"}
+        self._send(status, payload)
+        self.server.latency.record(endpoint, time.perf_counter() - started)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._handle('/stats', lambda: {'endpoints': self.server.latency.snapshot()})
+        elif self.path == '/health':
+            self._handle('/health', lambda: {'status': 'ok'})
+        else:
+            self._send(404, {'error': "Неизвестный путь"})
+
+    def do_POST(self):
+        routes = {
+            '/check': self.check,
+            '/grant': lambda: self.mutate('grant_right', ('grantor', 'recipient', 'object', 'right')),
+            '/revoke': lambda: self.mutate('revoke_right', ('revoker', 'target', 'object', 'right')),
+        }
+        handler = routes.get(self.path)
+        if handler is None:
+            try:
+                self.rfile.read(self._content_length())
+            except BadRequest as error:
+                self._send(400, {'error': str(error)})
+                return
+            self._send(404, {'error': "Неизвестный путь"})
+            return
+        self._handle(self.path, handler)
+
+    def check(self):
+        db = self.server.db
+        items = [_arguments(item, ('subject', 'object', 'right')) for item in _batch(self._read_json())]
+        return {'results': [db.check(*args) for args in items]}
+
+    def mutate(self, method, fields):
+        # Пакет выполняется в одной транзакции; с "atomic": true любая ошибка
+        # откатывает весь пакет (HRUDatabase.apply)
+        db = self.server.db
+        payload = self._read_json()
+        items = [_arguments(item, fields, lists=('right',)) for item in _batch(payload)]
+        if isinstance(payload, dict) and payload.get('atomic'):
+            results = db.apply([(method, *args) for args in items])
+        else:
+            with db.transaction():
+                results = [getattr(db, method)(*args) for args in items]
+        return {'results': [{'success': success, 'message': message} for success, message in results]}
+
+
+class DecisionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, db):
+        super().__init__(address, DecisionHandler)
+        self.db = db
+        self.latency = LatencyRecorder()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сервис решений HRU модели")
+    parser.add_argument('--db', default='hru_model.db', help="путь к базе данных")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args(argv)
+
+    server = DecisionServer((args.host, args.port), HRUDatabase(args.db))
+    print(f"Сервис решений запущен на http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import heapq
+import itertools
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from model import HRUDatabase
+
+
+def shard_of(object_name, count):
+    # crc32 стабилен между процессами и запусками, в отличие от hash()
+    return zlib.crc32(object_name.encode()) % count
+
+
+class ShardedHRUDatabase:
+    # Маршрутизатор над N файлами HRUDatabase. Объекты и их столбцы прав
+    # лежат в шарде по хешу имени объекта; субъекты и алфавит прав
+    # копируются во все шарды в одном порядке, поэтому id субъектов и биты
+    # прав в шардах совпадают. Операции над объектом идут в один шард,
+    # запросы по субъекту выполняются во всех шардах параллельно.
+    # Атомарность гарантируется только в пределах одного шарда.
+    #
+    # Изменения субъектов и прав выполняются под общей блокировкой, чтобы
+    # все шарды применяли их в одном порядке. Если шарды ответили по-разному,
+    # реплики считаются разошедшимися: такие изменения отклоняются, пока
+    # verify() не подтвердит, что субъекты и права в шардах совпадают.
+    def __init__(self, paths, **kwargs):
+        self.shards = [HRUDatabase(str(path), **kwargs) for path in paths]
+        self._executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='hru-shard')
+        self._replica_lock = threading.Lock()
+        self.diverged = None
+
+    @classmethod
+    def open(cls, directory, count, **kwargs):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        return cls([directory / f'shard-{i:03d}.db' for i in range(count)], **kwargs)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for shard in self.shards:
+            shard.close()
+
+    def shard_for(self, object_name):
+        return self.shards[shard_of(object_name, len(self.shards))]
+
+    def _fan_out(self, name, *args):
+        return list(self._executor.map(lambda shard: getattr(shard, name)(*args), self.shards))
+
+    def _replicate(self, name, *args, precheck=None):
+        with self._replica_lock:
+            if self.diverged is not None:
+                return False, f"Реплики шардов расходятся: {self.diverged}"
+            if precheck is not None:
+                failure = precheck()
+                if failure is not None:
+                    return failure
+
+            futures = [self._executor.submit(getattr(shard, name), *args) for shard in self.shards]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as error:
+                    results.append((None, repr(error)))
+            if all(result[0] for result in results):
+                return results[0]
+            # Одинаковый отказ во всех шардах ничего не изменил
+            if all(result == results[0] for result in results) and results[0][0] is False:
+                return results[0]
+            failed = [i for i, result in enumerate(results) if not result[0]]
+            self.diverged = f"{name}{args}: ошибка в шардах {failed}: {results[failed[0]][1]}"
+            return False, f"Реплики шардов расходятся: {self.diverged}"
+
+    def verify(self):
+        # Сверка субъектов (с id) и алфавита прав во всех шардах; при
+        # совпадении снимает признак расхождения
+        with self._replica_lock:
+            first = self.shards[0]
+            consistent = all(
+                shard._subject_names == first._subject_names and shard.rights == first.rights
+                for shard in self.shards[1:]
+            )
+            if consistent:
+                self.diverged = None
+            return consistent
+
+    def create_subject(self, name):
+        def exists():
+            if any(shard.subject_id(name) is not None for shard in self.shards):
+                return False, f"Субъект {name} уже существует"
+        return self._replicate('create_subject', name, precheck=exists)
+
+    def delete_subject(self, name):
+        return self._replicate('delete_subject', name)
+
+    def delete_subjects(self, names):
+        return self._replicate('delete_subjects', list(names))
+
+    def register_right(self, name):
+        return self._replicate('register_right', name)
+
+    def create_object(self, object_name, owner_name):
+        return self.shard_for(object_name).create_object(object_name, owner_name)
+
+    def delete_object(self, object_name, subject_name):
+        return self.shard_for(object_name).delete_object(object_name, subject_name)
+
+    def delete_objects(self, object_names, subject_name):
+        # Каждый шард удаляет свою часть атомарно; проверка прав - до удаления
+        groups = {}
+        for name in dict.fromkeys(object_names):
+            groups.setdefault(shard_of(name, len(self.shards)), []).append(name)
+        for index, names in groups.items():
+            shard = self.shards[index]
+            if not all(shard.check(subject_name, name, 'own') for name in names):
+                return False, "Нет прав на удаление объектов или объекты не существуют"
+        count = 0
+        for index, names in groups.items():
+            success, message = self.shards[index].delete_objects(names, subject_name)
+            if not success:
+                return success, message
+            count += len(names)
+        return True, f"Удалено объектов: {count}"
+
+    def grant_right(self, grantor_name, recipient_name, object_name, right):
+        return self.shard_for(object_name).grant_right(grantor_name, recipient_name, object_name, right)
+
+    def revoke_right(self, revoker_name, target_name, object_name, right):
+        return self.shard_for(object_name).revoke_right(revoker_name, target_name, object_name, right)
+
+    def check(self, subject_name, object_name, right):
+        return self.shard_for(object_name).check(subject_name, object_name, right)
+
+    def get_subjects(self):
+        return self.shards[0].get_subjects()
+
+    def get_objects(self):
+        return list(heapq.merge(*self._fan_out('get_objects')))
+
+    def search_subjects(self, prefix='', limit=100, after=None):
+        return self.shards[0].search_subjects(prefix, limit, after)
+
+    def search_objects(self, prefix='', limit=100, after=None):
+        # Из каждого шарда берётся до limit имён, общая страница - первые limit
+        pages = self._fan_out('search_objects', prefix, limit, after)
+        names = list(itertools.islice(heapq.merge(*(names for names, _ in pages)), limit))
+        return names, (names[-1] if len(names) == limit else None)
+
+    @property
+    def rights(self):
+        return self.shards[0].rights
+
+    def get_rights(self, subject_name=None, object_name=None):
+        if object_name:
+            return self.shard_for(object_name).get_rights(subject_name, object_name)
+        if not subject_name:
+            return None
+        rows = [row for rows in self._fan_out('get_rights', subject_name) for row in rows]
+        return sorted(rows, key=lambda row: row['object'])
+
+    def iter_rights(self, subject_name=None, object_name=None, rights=None, match='any', page_size=1000):
+        if object_name is not None:
+            return self.shard_for(object_name).iter_rights(None, object_name, rights, match, page_size)
+        return itertools.chain.from_iterable(
+            shard.iter_rights(subject_name, None, rights, match, page_size) for shard in self.shards
+        )
+
+    def subjects_with_rights(self, object_name, rights, match='any'):
+        return self.shard_for(object_name).subjects_with_rights(object_name, rights, match)
+
+    def objects_with_rights(self, subject_name, rights, match='any'):
+        return list(heapq.merge(*self._fan_out('objects_with_rights', subject_name, rights, match)))
@@ -1,6 +1,30 @@
+import asyncio
+import http.client
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 from unittest.mock import patch, MagicMock
-from model import HRUDatabase, HRUConsole
+from model import HRUDatabase, HRUConsole, SCHEMA_VERSION, main, run_script
+from matrix import AccessMatrix, MappedMatrix, export_matrix
+from graph import GrantGraph
+from async_db import AsyncHRUDatabase
+from server import DecisionServer
+from journal import Journal, read_records, replay
+from bench import run_benchmark
+from sharding import ShardedHRUDatabase, shard_of
+from commands import Command, Condition, compile_commands, enter, parse_commands
+from group_commit import GroupCommitWriter
+from safety import ParallelSafetyAnalyzer, SafetyAnalyzer, State
+
+
+class FailingAnalyzer(ParallelSafetyAnalyzer):
+    # Уровень модуля: анализатор передаётся в процессы через pickle
+    def successors(self, state):
+        raise ValueError("сбой в процессе")
 
 
 @pytest.fixture
@@ -11,6 +35,7 @@ def db():
     db.conn.execute("DELETE FROM objects")
     db.conn.execute("DELETE FROM subjects")
     db.conn.commit()
+    db.reload()
 
     # Создаем тестовые данные
     success, _ = db.create_subject("admin")
@@ -66,6 +91,989 @@ class TestHRUDatabase:
         print("✓ test_rights_management - УСПЕХ")
 
 
+class TestTransactions:
+    def test_apply_batch(self, db):
+        results = db.apply([
+            ('create_subject', 'user1'),
+            ('create_subject', 'user2'),
+            ('create_object', 'file2', 'user1'),
+            ('grant_right', 'admin', 'user2', 'file1', 'write'),
+        ])
+        assert all(success for success, _ in results)
+        assert len(results) == 4
+        assert {'user1', 'user2'} <= set(db.get_subjects())
+        assert db.get_rights("user2", "file1")['write'] is True
+        print("✓ test_apply_batch - УСПЕХ")
+
+    def test_apply_rolls_back_on_failure(self, db):
+        results = db.apply([
+            ('create_subject', 'user1'),
+            ('create_object', 'file2', 'user1'),
+            ('grant_right', 'user1', 'admin', 'file1', 'read'),
+        ])
+        assert results[2][0] is False
+        assert "Нет прав" in results[2][1]
+        assert results[0] == (False, "Команда отменена: пакет откатан")
+        assert "user1" not in db.get_subjects()
+        assert "file2" not in db.get_objects()
+
+        results = db.apply([('create_subject', 'user1'), ('create_subject', 'admin')])
+        assert results[1] == (False, "Субъект admin уже существует")
+        assert "user1" not in db.get_subjects()
+        print("✓ test_apply_rolls_back_on_failure - УСПЕХ")
+
+    def test_transaction_context(self, db):
+        with pytest.raises(RuntimeError):
+            with db.transaction():
+                db.create_subject("user1")
+                raise RuntimeError
+        assert "user1" not in db.get_subjects()
+
+        with db.transaction():
+            db.create_subject("user1")
+            db.grant_right("admin", "user1", "file1", "read")
+        assert db.get_rights("user1", "file1")['read'] is True
+        print("✓ test_transaction_context - УСПЕХ")
+
+    def test_apply_inside_transaction_rolls_back(self, db):
+        with pytest.raises(RuntimeError):
+            with db.transaction():
+                db.apply([('create_subject', 'user1')])
+                db.create_subject("user2")
+                raise RuntimeError
+        assert "user1" not in db.get_subjects()
+        assert "user2" not in db.get_subjects()
+        print("✓ test_apply_inside_transaction_rolls_back - УСПЕХ")
+
+
+class TestRightsMask:
+    def test_register_right_and_multi_grant(self, db):
+        db.create_subject("user1")
+        success, msg = db.register_right("execute")
+        assert success is True
+        assert db.register_right("execute")[0] is False
+
+        success, msg = db.grant_right("admin", "user1", "file1", ["read", "execute"])
+        assert success is True
+        rights = db.get_rights("user1", "file1")
+        assert rights['read'] is True and rights['execute'] is True and rights['write'] is False
+        assert db.check("user1", "file1", "execute") is True
+
+        assert db.subjects_with_rights("file1", ["read", "execute"], match='all') == ["user1"]
+        assert db.subjects_with_rights("file1", ["read", "execute"]) == ["admin", "user1"]
+        assert db.subjects_with_rights("file1", ["write", "own"], match='any') == ["admin"]
+        assert db.objects_with_rights("user1", "execute") == ["file1"]
+
+        success, msg = db.revoke_right("admin", "user1", "file1", ("read", "execute"))
+        assert success is True
+        assert db.get_rights("user1", "file1")['execute'] is False
+        db.conn.execute("DELETE FROM rights WHERE name = 'execute'")
+        db.conn.commit()
+        print("✓ test_register_right_and_multi_grant - УСПЕХ")
+
+    def test_migration_from_right_columns(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        conn = sqlite3.connect('hru_model.db')
+        conn.executescript('''
+            CREATE TABLE subjects (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL);
+            CREATE TABLE objects (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL,
+                                  owner_id INTEGER NOT NULL);
+            CREATE TABLE permissions (subject_id INTEGER NOT NULL, object_id INTEGER NOT NULL,
+                                      read INTEGER DEFAULT 0, write INTEGER DEFAULT 0, own INTEGER DEFAULT 0,
+                                      PRIMARY KEY (subject_id, object_id));
+            INSERT INTO subjects (name) VALUES ('admin'), ('user1');
+            INSERT INTO objects (name, owner_id) VALUES ('file1', 1);
+            INSERT INTO permissions VALUES (1, 1, 1, 1, 1), (2, 1, 1, 0, 0);
+        ''')
+        conn.commit()
+        conn.close()
+
+        db = HRUDatabase()
+        assert db.get_rights("admin", "file1") == {'read': True, 'write': True, 'own': True}
+        assert db.get_rights("user1", "file1") == {'read': True, 'write': False, 'own': False}
+        columns = [row[1] for row in db.conn.execute("PRAGMA table_info(permissions)")]
+        assert columns == ['subject_id', 'object_id', 'rights']
+        db.conn.close()
+        print("✓ test_migration_from_right_columns - УСПЕХ")
+
+
+class TestMigrations:
+    def test_schema_is_versioned_and_indexed(self, db):
+        assert db.schema_version() == SCHEMA_VERSION
+        indexes = {row[1] for row in db.conn.execute("SELECT type, name FROM sqlite_master WHERE type = 'index'")}
+        assert {'permissions_by_object', 'objects_by_owner'} <= indexes
+
+        plan = " ".join(str(row) for row in db.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT subject_id, rights FROM permissions WHERE object_id = ?", (1,)
+        ))
+        assert "COVERING INDEX permissions_by_object" in plan
+
+        db.create_tables()
+        assert db.schema_version() == SCHEMA_VERSION
+        print("✓ test_schema_is_versioned_and_indexed - УСПЕХ")
+
+    def test_newer_schema_is_rejected(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        conn = sqlite3.connect('hru_model.db')
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+        conn.close()
+        with pytest.raises(sqlite3.DatabaseError):
+            HRUDatabase()
+        print("✓ test_newer_schema_is_rejected - УСПЕХ")
+
+
+class TestConcurrency:
+    def test_thread_pool_reads_and_writes(self, tmp_path):
+        db = HRUDatabase(str(tmp_path / 'hru.db'), readers=4)
+        db.create_subject("admin")
+        db.create_object("file1", "admin")
+        names = [f"user{i}" for i in range(40)]
+        db.apply([('create_subject', name) for name in names])
+        assert db.conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+
+        def grant(name):
+            return db.grant_right("admin", name, "file1", "read")[0]
+
+        def check(name):
+            return db.check(name, "file1", "read") in (True, False)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            grants = pool.map(grant, names)
+            checks = pool.map(check, names * 5)
+            assert all(grants) and all(checks)
+
+        assert all(db.check(name, "file1", "read") for name in names)
+        assert len(db.get_rights(object_name="file1")) == len(names) + 1
+        db.close()
+        print("✓ test_thread_pool_reads_and_writes - УСПЕХ")
+
+    def test_memory_database(self):
+        db = HRUDatabase(':memory:')
+        db.create_subject("admin")
+        db.create_object("file1", "admin")
+        assert db.check("admin", "file1", "own") is True
+        assert db.get_subjects() == ["admin"]
+        db.close()
+        print("✓ test_memory_database - УСПЕХ")
+
+
+class TestAsyncDatabase:
+    def test_async_operations(self, tmp_path):
+        async def scenario():
+            async with AsyncHRUDatabase(path=str(tmp_path / 'hru.db')) as adb:
+                assert (await adb.create_subject("admin"))[0] is True
+                assert (await adb.create_object("file1", "admin"))[0] is True
+                await adb.create_subject("user1")
+                success, msg = await adb.grant_right("admin", "user1", "file1", "read")
+                assert success is True
+                checks = await adb.check_many([("user1", "file1", "read"), ("user1", "file1", "write")])
+                assert checks == [True, False]
+                assert (await adb.get_rights("user1", "file1"))['read'] is True
+
+        asyncio.run(scenario())
+        print("✓ test_async_operations - УСПЕХ")
+
+    def test_identical_reads_are_coalesced(self, db):
+        calls = []
+        original = db.get_subjects
+
+        def slow_get_subjects():
+            calls.append(1)
+            time.sleep(0.05)
+            return original()
+
+        db.get_subjects = slow_get_subjects
+
+        async def scenario():
+            adb = AsyncHRUDatabase(db)
+            results = await asyncio.gather(*(adb.get_subjects() for _ in range(20)))
+            await adb.close()
+            return adb, results
+
+        adb, results = asyncio.run(scenario())
+        assert len(calls) == 1
+        assert adb.coalesced == 19
+        assert all(result == ["admin"] for result in results)
+        print("✓ test_identical_reads_are_coalesced - УСПЕХ")
+
+    def test_read_after_write_is_not_coalesced_with_older_read(self, db):
+        db.create_subject("user1")
+        original = db.check
+
+        def slow_check(*args):
+            result = original(*args)
+            time.sleep(0.1)
+            return result
+
+        db.check = slow_check
+
+        async def scenario():
+            adb = AsyncHRUDatabase(db)
+            before = asyncio.ensure_future(adb.check("user1", "file1", "read"))
+            await asyncio.sleep(0.02)
+            await adb.grant_right("admin", "user1", "file1", "read")
+            after = await adb.check("user1", "file1", "read")
+            result = (await before, after)
+            await adb.close()
+            return result
+
+        assert asyncio.run(scenario()) == (False, True)
+        print("✓ test_read_after_write_is_not_coalesced_with_older_read - УСПЕХ")
+
+
+class TestDecisionServer:
+    def test_batched_requests_over_keep_alive(self, db):
+        db.create_subject("user1")
+        server = DecisionServer(('127.0.0.1', 0), db)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+
+        def post(path, payload):
+            conn.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+
+        status, body = post('/grant', {'requests': [
+            {'grantor': 'admin', 'recipient': 'user1', 'object': 'file1', 'right': 'read'},
+            ['user1', 'admin', 'file1', 'write'],
+        ]})
+        assert status == 200
+        assert [result['success'] for result in body['results']] == [True, False]
+
+        status, body = post('/check', [['user1', 'file1', 'read'], ['user1', 'file1', 'write']])
+        assert body['results'] == [True, False]
+
+        status, body = post('/check', {'requests': [{'subject': 'user1'}]})
+        assert status == 400
+
+        conn.request('GET', '/stats')
+        stats = json.loads(conn.getresponse().read())['endpoints']
+        assert stats['/check']['count'] == 2
+        assert stats['/grant']['p99_ms'] >= stats['/grant']['p50_ms'] >= 0
+
+        conn.close()
+        server.shutdown()
+        server.server_close()
+        print("✓ test_batched_requests_over_keep_alive - УСПЕХ")
+
+    def test_invalid_requests_get_a_response(self, db):
+        server = DecisionServer(('127.0.0.1', 0), db)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+
+        def post(path, body, headers=None):
+            conn.request('POST', path, body, headers or {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+
+        status, body = post('/grant', json.dumps([[{'x': 1}, 'admin', 'file1', 'read']]))
+        assert status == 400 and "grantor" in body['error']
+        status, body = post('/check', json.dumps([['admin', 'file1', ['read']]]))
+        assert status == 400
+        status, body = post('/grant', json.dumps([['admin', 'admin', 'file1', ['read', 'write']]]))
+        assert status == 200 and body['results'][0]['success'] is True
+
+        with patch.object(db, 'check', side_effect=RuntimeError):
+            status, body = post('/check', json.dumps([['admin', 'file1', 'read']]))
+        assert status == 500 and 'error' in body
+
+        status, body = post('/check', b'[]', {'Content-Length': 'abc'})
+        assert status == 400
+        conn.close()
+        server.shutdown()
+        server.server_close()
+        print("✓ test_invalid_requests_get_a_response - УСПЕХ")
+
+
+class TestJournal:
+    def test_replay_restores_state(self, tmp_path):
+        db = HRUDatabase(str(tmp_path / 'source.db'))
+        journal = Journal(db, tmp_path / 'journal', checkpoint_every=3)
+        db.create_subject("admin")
+        db.create_subject("user1")
+        db.create_object("file1", "admin")
+        db.register_right("execute")
+        db.grant_right("admin", "user1", "file1", ["read", "execute"])
+        db.apply([
+            ('create_object', 'file2', 'user1'),
+            ('grant_right', 'user1', 'admin', 'file1', 'write'),
+        ])
+        with db.transaction():
+            db.create_object("file3", "user1")
+            db.delete_subject("user1")
+        journal.close()
+
+        # Откатанный пакет в журнал не попал, старые сегменты удалены
+        assert not any(record['op'] == 'grant_right' and record['args'][3] == 'write'
+                       for record in read_records(tmp_path / 'journal'))
+        assert len(list((tmp_path / 'journal').glob('checkpoint-*.json'))) == 1
+
+        copy = HRUDatabase(str(tmp_path / 'copy.db'))
+        assert replay(tmp_path / 'journal', copy) == journal.seq
+        assert copy.dump() == db.dump()
+        assert copy.get_rights("admin", "file3") == db.get_rights("admin", "file3")
+        db.close()
+        copy.close()
+        print("✓ test_replay_restores_state - УСПЕХ")
+
+    def test_torn_tail_is_ignored(self, tmp_path):
+        db = HRUDatabase(str(tmp_path / 'source.db'))
+        journal = Journal(db, tmp_path / 'journal')
+        db.create_subject("admin")
+        db.create_object("file1", "admin")
+        journal.close()
+        segment = next((tmp_path / 'journal').glob('journal-*.log'))
+        with open(segment, 'a', encoding='utf-8') as file:
+            file.write('{"seq": 3, "op": "create_sub')
+
+        copy = HRUDatabase(str(tmp_path / 'copy.db'))
+        assert replay(tmp_path / 'journal', copy) == 2
+        assert copy.get_objects() == ["file1"]
+        copy.close()
+
+        # После восстановления журнал продолжается с целой строки
+        journal = Journal(db, tmp_path / 'journal')
+        assert journal.seq == 2
+        db.create_subject("user1")
+        db.grant_right("admin", "user1", "file1", "read")
+        journal.close()
+        copy = HRUDatabase(str(tmp_path / 'copy2.db'))
+        assert replay(tmp_path / 'journal', copy) == 4
+        assert copy.get_rights("user1", "file1")['read'] is True
+        db.close()
+        copy.close()
+        print("✓ test_torn_tail_is_ignored - УСПЕХ")
+
+
+class TestPagination:
+    def test_keyset_pages_and_stream(self, db):
+        db.create_subject("user1")
+        with db.transaction():
+            for i in range(25):
+                db.create_object(f"doc{i:02d}", "admin")
+                if i % 2:
+                    db.grant_right("admin", "user1", f"doc{i:02d}", "read")
+
+        pages, cursor = [], None
+        while True:
+            items, cursor = db.get_rights_page(subject_name="admin", limit=10, cursor=cursor)
+            pages.append(items)
+            if cursor is None:
+                break
+        assert [len(items) for items in pages] == [10, 10, 6]
+        streamed = list(db.iter_rights(subject_name="admin", page_size=7))
+        assert streamed == [item for items in pages for item in items]
+        assert sorted(streamed, key=lambda item: item['object']) == \
+            sorted(db.get_rights(subject_name="admin"), key=lambda item: item['object'])
+
+        readers = [item['subject'] for item in db.iter_rights(object_name="doc03", rights="read")]
+        assert sorted(readers) == ["admin", "user1"]
+        assert len(list(db.iter_rights(subject_name="user1", rights=["write"]))) == 0
+        assert len(list(db.iter_rights(subject_name="user1", rights="read", page_size=5))) == 12
+        with pytest.raises(ValueError):
+            db.get_rights_page(subject_name="admin", cursor="s5")
+        print("✓ test_keyset_pages_and_stream - УСПЕХ")
+
+
+class TestNameSearch:
+    def test_search_names_by_prefix(self, db):
+        db.apply([('create_subject', f'user{i:02d}') for i in range(25)])
+        db.create_subject("ёж")
+
+        names, cursor = db.search_subjects("user1", limit=4)
+        assert names == ["user10", "user11", "user12", "user13"] and cursor == "user13"
+        names, cursor = db.search_subjects("user1", limit=4, after=cursor)
+        assert names == ["user14", "user15", "user16", "user17"]
+        assert db.search_subjects("user1", limit=10, after="user17") == (["user18", "user19"], None)
+        assert db.search_subjects("ё") == (["ёж"], None)
+        assert db.search_objects("file") == (["file1"], None)
+        print("✓ test_search_names_by_prefix - УСПЕХ")
+
+
+class TestBenchmark:
+    def test_benchmark_report(self, tmp_path):
+        db = HRUDatabase(str(tmp_path / 'bench.db'))
+        report = run_benchmark(db, subjects=10, objects=30, density=0.2, operations=300)
+        json.dumps(report)
+        assert report['total']['count'] == 300
+        assert sum(stats['count'] for stats in report['operations'].values()) == 300
+        assert report['operations']['check']['p99_ms'] >= report['operations']['check']['p50_ms']
+        assert len(db.get_objects()) == 30
+        db.close()
+        print("✓ test_benchmark_report - УСПЕХ")
+
+
+class TestBulkDelete:
+    def test_delete_subjects_reassigns_deterministically(self, db):
+        matrix = AccessMatrix(db)
+        for name in ("user1", "user2", "user3"):
+            db.create_subject(name)
+        db.create_object("doc1", "user1")
+        db.create_object("doc2", "user2")
+        db.grant_right("user2", "user3", "doc2", "own")
+        db.grant_right("user1", "user2", "doc1", "read")
+
+        success, _ = db.delete_subjects(["user1", "user2"])
+        assert success is True
+        # doc2 переходит к оставшемуся совладельцу, doc1 - к субъекту с наименьшим id
+        assert db.get_rights("user3", "doc2")['own'] is True
+        assert db.get_rights("admin", "doc1") == {'read': False, 'write': False, 'own': True}
+        assert db.get_rights("admin", "file1")['own'] is True
+        assert db.conn.execute(
+            "SELECT COUNT(*) FROM permissions WHERE subject_id NOT IN (SELECT id FROM subjects)"
+        ).fetchone()[0] == 0
+        assert matrix.column("doc1", "own") == ["admin"]
+        assert db.delete_subjects(["user3", "ghost"])[0] is False
+        assert "user3" in db.get_subjects()
+        matrix.close()
+        print("✓ test_delete_subjects_reassigns_deterministically - УСПЕХ")
+
+    def test_delete_objects_in_one_pass(self, db):
+        db.create_subject("user1")
+        db.apply([('create_object', f"tmp{i}", "admin") for i in range(50)])
+        db.create_object("private", "user1")
+
+        assert db.delete_objects(["tmp1", "private"], "admin")[0] is False
+        assert "tmp1" in db.get_objects()
+        success, msg = db.delete_objects([f"tmp{i}" for i in range(50)], "admin")
+        assert success is True and msg == "Удалено объектов: 50"
+        assert db.get_objects() == ["file1", "private"]
+        db.delete_subjects(["admin", "user1"])
+        assert db.get_objects() == []
+        print("✓ test_delete_objects_in_one_pass - УСПЕХ")
+
+    def test_last_co_owner_deletion_keeps_an_owner(self, db):
+        db.create_subject("user1")
+        db.grant_right("admin", "user1", "file1", "own")
+        db.revoke_right("user1", "admin", "file1", "own")
+        assert db.check("admin", "file1", "own") is False
+        db.delete_subject("user1")
+        assert db.get_rights("admin", "file1")['own'] is True
+        assert db.check("admin", "file1", "own") is True
+        print("✓ test_last_co_owner_deletion_keeps_an_owner - УСПЕХ")
+
+
+class TestAnalytics:
+    def test_vectorized_reports(self, db):
+        pytest.importorskip("numpy")
+        from analytics import AccessAnalytics
+
+        for name in ("user1", "user2", "user3"):
+            db.create_subject(name)
+        db.create_object("file2", "user1")
+        db.revoke_right("user1", "user1", "file2", "write")
+        for name in ("user1", "user2"):
+            db.grant_right("admin", name, "file1", "read")
+        db.grant_right("user1", "user2", "file2", "read")
+
+        analytics = AccessAnalytics(db)
+        assert analytics.shape == (4, 2)
+        assert analytics.objects_without("write") == ["file2"]
+        assert analytics.subjects_over("own", 0) == ["admin", "user1"]
+        assert analytics.object_counts("read").tolist() == [3, 2]
+        assert analytics.has(["read", "own"], match='all').sum() == 2
+        assert sorted(analytics.cells("read")) == [
+            ("admin", "file1"), ("user1", "file1"), ("user1", "file2"),
+            ("user2", "file1"), ("user2", "file2"),
+        ]
+
+        names, overlap = analytics.overlap("read", ["user1", "user2", "user3"])
+        assert overlap.tolist() == [[2, 2, 0], [2, 2, 0], [0, 0, 0]]
+        # Блоки по одному столбцу дают тот же результат
+        assert analytics.overlap("read", chunk_cells=1)[1].tolist() == analytics.overlap("read")[1].tolist()
+        assert analytics.to_dense().dtype.name == 'uint8'
+        print("✓ test_vectorized_reports - УСПЕХ")
+
+
+class TestCompiledCommands:
+    def test_parse_round_trip(self):
+        text = """
+        # передача права чтения владельцем
+        command share(s1, s2, o):
+            if own in (s1, o) and read in (s1, o)
+            then enter read into (s2, o); enter write into (s2, o)
+        command spawn(s, t, o): create subject t; create object o; enter own into (t, o)
+        """
+        share, spawn = parse_commands(text)
+        assert [c.right for c in share.conditions] == ["own", "read"]
+        assert spawn.created == {"t", "o"}
+        assert repr(parse_commands(repr(share))[0]) == repr(share)
+        with pytest.raises(ValueError):
+            parse_commands("command bad(s, o): enter read (s, o)")
+        print("✓ test_parse_round_trip - УСПЕХ")
+
+    def test_compiled_command_is_atomic(self, db, tmp_path):
+        matrix = AccessMatrix(db)
+        db.create_subject("user1")
+        plans = compile_commands("""
+        command share(s1, s2, o): if own in (s1, o) then enter read into (s2, o); enter write into (s2, o)
+        command spawn(s, t, o): create subject t; create object o; enter own into (t, o); enter read into (s, o)
+        command twins(t, u): create subject t; create subject u
+        """, db)
+
+        assert db.check("user1", "file1", "read") is False
+        assert plans['share']("admin", "user1", "file1")[0] is True
+        assert db.get_rights("user1", "file1") == {'read': True, 'write': True, 'own': False}
+        assert db.check("user1", "file1", "write") and matrix.check("user1", "file1", "write")
+        assert plans['share']("user1", "admin", "file1") == (False, "Команда share: условия не выполнены")
+
+        assert plans['spawn']("user1", "user2", "file2")[0] is True
+        assert db.get_rights("user2", "file2")['own'] is True
+        assert matrix.row("user1", "read") == ["file1", "file2"]
+        # Ошибка посреди команды откатывает все её операции
+        assert plans['spawn']("user1", "user3", "file2")[0] is False
+        assert plans['twins']("user4", "user4")[0] is False
+        assert "user4" not in db.get_subjects()
+        matrix.close()
+        print("✓ test_compiled_command_is_atomic - УСПЕХ")
+
+    def test_compiled_command_order_and_nesting(self, db):
+        plans = compile_commands("""
+        command mk(o, s): create object o; create subject s; enter own into (s, o)
+        command twins(t, u): create subject t; create subject u
+        """, db)
+        assert plans['mk']("doc", "user1")[0] is True
+        assert db.get_rights("user1", "doc")['own'] is True
+        with pytest.raises(ValueError):
+            compile_commands("command bad(s, o): enter read into (s, o); create object o", db)
+
+        # Внутри внешней транзакции откатывается только неудавшаяся команда
+        with db.transaction():
+            db.create_subject("user2")
+            assert plans['twins']("x", "x")[0] is False
+            assert db.subject_id("x") is None
+        assert "x" not in db.get_subjects()
+        assert "user2" in db.get_subjects()
+        print("✓ test_compiled_command_order_and_nesting - УСПЕХ")
+
+
+class TestGrantGraph:
+    def test_incremental_reachability(self, db):
+        graph = GrantGraph(db)
+        for name in ("user1", "user2", "user3"):
+            db.create_subject(name)
+        db.create_object("doc1", "user1")
+        db.create_object("doc2", "user2")
+        db.create_object("doc3", "user3")
+        assert graph.subjects_reaching("doc2") == ["user2"]
+
+        # admin делится file1 с user1, user1 делится doc1 с user2
+        db.grant_right("admin", "user1", "file1", "read")
+        db.grant_right("user1", "user2", "doc1", "read")
+        assert graph.reachable("admin") == ["admin", "user1", "user2"]
+        assert graph.connected("user2", "file1") is True
+        assert graph.connected("user3", "file1") is False
+
+        db.revoke_right("user1", "user2", "doc1", "read")
+        assert graph.reachable("admin") == ["admin", "user1"]
+        db.grant_right("user2", "user3", "doc2", "write")
+        db.grant_right("user1", "user2", "doc1", "own")
+        assert graph.subjects_reaching("file1") == ["admin", "user1", "user2", "user3"]
+
+        db.delete_subject("user2")
+        fresh = GrantGraph(db)
+        for name in db.get_subjects():
+            assert graph.reachable(name) == fresh.reachable(name)
+        for name in db.get_objects():
+            assert graph.subjects_reaching(name) == fresh.subjects_reaching(name)
+        graph.close()
+        fresh.close()
+        print("✓ test_incremental_reachability - УСПЕХ")
+
+
+class TestSharding:
+    def test_router_partitions_objects(self, tmp_path):
+        db = ShardedHRUDatabase.open(tmp_path / 'shards', 3)
+        db.create_subject("admin")
+        db.create_subject("user1")
+        assert db.create_subject("user1")[0] is False
+        names = [f"doc{i}" for i in range(30)]
+        for name in names:
+            db.create_object(name, "admin")
+            db.grant_right("admin", "user1", name, "read")
+
+        placement = [shard.get_objects() for shard in db.shards]
+        assert all(placement)
+        assert sorted(sum(placement, [])) == db.get_objects() == sorted(names)
+        assert all(name in placement[shard_of(name, 3)] for name in names)
+        assert all(shard.get_subjects() == ["admin", "user1"] for shard in db.shards)
+
+        assert db.check("user1", "doc7", "read") and not db.check("user1", "doc7", "write")
+        rows = db.get_rights(subject_name="user1")
+        assert [row['object'] for row in rows] == sorted(names)
+        assert len(list(db.iter_rights(subject_name="admin", rights="own"))) == 30
+        assert db.objects_with_rights("user1", "read") == sorted(names)
+
+        assert db.delete_objects(["doc1", "doc2"], "user1")[0] is False
+        assert db.delete_objects(["doc1", "doc2", "doc3"], "admin") == (True, "Удалено объектов: 3")
+        db.delete_subject("admin")
+        assert db.get_rights("user1", "doc4")['own'] is True
+        db.close()
+        print("✓ test_router_partitions_objects - УСПЕХ")
+
+    def test_replicated_writes_stay_in_step(self, tmp_path):
+        db = ShardedHRUDatabase.open(tmp_path / 'shards', 3)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(db.create_subject, [f"user{i}" for i in range(40)]))
+        assert db.verify() is True
+        assert all(shard.subject_id("user7") == db.shards[0].subject_id("user7") for shard in db.shards)
+
+        with patch.object(db.shards[1], 'create_subject', side_effect=sqlite3.OperationalError("disk")):
+            success, message = db.create_subject("broken")
+        assert success is False and "расходятся" in message
+        assert db.create_subject("user100")[0] is False
+        assert db.verify() is False
+        db.shards[1].create_subject("broken")
+        assert db.verify() is True
+        assert db.create_subject("user100")[0] is True
+        db.close()
+        print("✓ test_replicated_writes_stay_in_step - УСПЕХ")
+
+
+class TestInterning:
+    def test_id_based_operations(self, db):
+        db.create_subject("user1")
+        admin, user1 = db.subject_id("admin"), db.subject_id("user1")
+        file1 = db.object_id("file1")
+        assert db.subject_name(user1) == "user1"
+        assert db.object_name(file1) == "file1"
+
+        success, msg = db.grant_right_by_id(admin, user1, file1, "write")
+        assert success is True
+        assert db.check_by_id(user1, file1, "write") is True
+        assert db.get_rights_by_id(user1, file1)['write'] is True
+        assert db.get_rights("user1", "file1")['write'] is True
+
+        success, msg = db.delete_object_by_id(file1, user1)
+        assert success is False
+        success, msg = db.delete_subject_by_id(user1)
+        assert success is True
+        assert db.subject_id("user1") is None
+        print("✓ test_id_based_operations - УСПЕХ")
+
+    def test_names_restored_after_rollback(self, db):
+        db.apply([('create_subject', 'user1'), ('delete_subject', 'nobody')])
+        assert db.subject_id("user1") is None
+        success, msg = db.grant_right("admin", "user1", "file1", "read")
+        assert success is False
+        print("✓ test_names_restored_after_rollback - УСПЕХ")
+
+
+class TestDecisionCache:
+    def test_check_is_cached_and_invalidated(self, db):
+        db.create_subject("user1")
+        assert db.check("user1", "file1", "read") is False
+        assert db.check("user1", "file1", "read") is False
+        assert db.cache.hits == 1
+
+        db.grant_right("admin", "user1", "file1", "read")
+        assert db.check("user1", "file1", "read") is True
+        db.revoke_right("admin", "user1", "file1", "read")
+        assert db.check("user1", "file1", "read") is False
+
+        assert db.check("admin", "file1", "own") is True
+        db.delete_object("file1", "admin")
+        assert db.check("admin", "file1", "own") is False
+        print("✓ test_check_is_cached_and_invalidated - УСПЕХ")
+
+    def test_check_after_ownership_transfer(self, db):
+        db.create_subject("user1")
+        db.grant_right("admin", "user1", "file1", "read")
+        assert db.check("user1", "file1", "own") is False
+        db.delete_subject("admin")
+        assert db.check("user1", "file1", "own") is True
+        print("✓ test_check_after_ownership_transfer - УСПЕХ")
+
+
+class TestAccessMatrix:
+    def test_matrix_write_through(self, db):
+        matrix = AccessMatrix(db)
+        assert matrix.check("admin", "file1", "own") is True
+
+        db.create_subject("user1")
+        db.grant_right("admin", "user1", "file1", "read")
+        assert matrix.check("user1", "file1", "read") is True
+        assert matrix.column("file1", "read") == ["admin", "user1"]
+
+        db.revoke_right("admin", "user1", "file1", "read")
+        assert matrix.check("user1", "file1", "read") is False
+
+        db.create_object("file2", "user1")
+        assert matrix.row("user1", "own") == ["file2"]
+        db.delete_object("file2", "user1")
+        assert matrix.row("user1", "own") == []
+        matrix.close()
+        print("✓ test_matrix_write_through - УСПЕХ")
+
+    def test_matrix_resyncs_after_rollback(self, db):
+        matrix = AccessMatrix(db)
+        db.apply([
+            ('create_subject', 'user1'),
+            ('grant_right', 'admin', 'user1', 'file1', 'read'),
+            ('grant_right', 'user1', 'admin', 'file1', 'read'),
+        ])
+        assert matrix.check("user1", "file1", "read") is False
+        assert matrix.get_rights("user1", "file1") is None
+        matrix.close()
+        print("✓ test_matrix_resyncs_after_rollback - УСПЕХ")
+
+    def test_mapped_matrix_export(self, tmp_path):
+        db = HRUDatabase(str(tmp_path / 'hru.db'))
+        db.create_subject("admin")
+        db.create_object("file1", "admin")
+        db.create_subject("user1")
+        db.create_subject("пользователь")
+        db.create_object("file2", "user1")
+        db.register_right("execute")
+        db.grant_right("admin", "user1", "file1", ["read", "execute"])
+        db.grant_right("user1", "пользователь", "file2", "write")
+        path = tmp_path / 'matrix.bin'
+        assert export_matrix(db, path) == 4
+
+        with MappedMatrix(path) as mapped:
+            assert mapped.shape == (3, 2)
+            assert mapped.rights == db.rights
+            assert mapped.check("user1", "file1", "execute") is True
+            assert mapped.check("user1", "file1", "write") is False
+            assert mapped.get_rights("пользователь", "file2") == db.get_rights("пользователь", "file2")
+            assert mapped.get_rights("nobody", "file1") is None
+            assert mapped.row("admin", "own") == ["file1"]
+            assert mapped.row("user1", "read") == ["file1", "file2"]
+
+        # Снимок вызывающего после экспорта остаётся открытым
+        with db.snapshot() as snapshot:
+            assert export_matrix(snapshot, tmp_path / 'pinned.bin') == 4
+            assert snapshot.check("user1", "file1", "read") is True
+        db.close()
+        print("✓ test_mapped_matrix_export - УСПЕХ")
+
+
+class TestSafety:
+    def test_leak_with_witness(self, db):
+        db.create_subject("user1")
+        result = SafetyAnalyzer(max_depth=2).analyze(db, "user1", "file1", "write")
+        assert result.leaked is True
+        assert result.witness == [('grant_write', ('admin', 'user1', 'file1'))]
+        print("✓ test_leak_with_witness - УСПЕХ")
+
+    def test_safe_state_under_restricted_commands(self):
+        commands = [
+            Command('share', ['s1', 's2', 'o'], [Condition('read', 's1', 'o')], [enter('read', 's2', 'o')]),
+            Command('promote', ['s1', 's2', 'o'],
+                    [Condition('read', 's1', 'o'), Condition('read', 's2', 'o')],
+                    [enter('write', 's2', 'o')]),
+        ]
+        state = State(['alice', 'bob', 'carol'], ['f', 'g'], [('alice', 'f', 'read')])
+        analyzer = SafetyAnalyzer(commands, max_depth=4)
+
+        result = analyzer.analyze(state, "carol", "f", "write")
+        assert result.leaked is True
+        assert [name for name, _ in result.witness] == ['share', 'promote']
+
+        result = analyzer.analyze(state, "carol", "g", "read")
+        assert result.leaked is False
+        assert result.truncated is False
+        print("✓ test_safe_state_under_restricted_commands - УСПЕХ")
+
+    def test_parallel_matches_sequential(self):
+        state = State(['a', 'b', 'c'], ['x', 'y'], [('a', 'x', 'own')])
+        sequential = SafetyAnalyzer(max_depth=2).analyze(state, 'c', 'y', 'read')
+        parallel = ParallelSafetyAnalyzer(max_depth=2, workers=2).analyze(state, 'c', 'y', 'read')
+        assert parallel.leaked is sequential.leaked is False
+        assert parallel.states == sequential.states
+        assert len(parallel.workers) == 2
+
+        result = ParallelSafetyAnalyzer(max_depth=2, workers=2).analyze(state, 'b', 'x', 'write')
+        assert result.leaked is True
+        assert result.witness == [('grant_write', ('a', 'b', 'x'))]
+        print("✓ test_parallel_matches_sequential - УСПЕХ")
+
+    def test_parallel_worker_failure_is_reported(self):
+        state = State(['a', 'b'], ['x'], [('a', 'x', 'own')])
+        started = time.perf_counter()
+        with pytest.raises(RuntimeError, match="сбой в процессе"):
+            FailingAnalyzer(max_depth=2, workers=2).analyze(state, 'b', 'x', 'write')
+        assert time.perf_counter() - started < 10
+        print("✓ test_parallel_worker_failure_is_reported - УСПЕХ")
+
+
+class TestStatistics:
+    def test_stats_collects_calls_and_slow_log(self, db):
+        assert db.stats() is None
+        db.enable_stats(slow_ms=0)
+        db.create_subject("user1")
+        db.grant_right("admin", "user1", "file1", "read")
+        db.check("user1", "file1", "read")
+
+        stats = db.stats()
+        grant = stats['methods']['grant_right']
+        assert grant['calls'] == 1
+        assert grant['statements'] >= 2 and grant['rows'] == 1
+        assert sum(grant['histogram'].values()) == 1
+        assert any("'user1'" in statement
+                   for entry in stats['slow_queries'] if entry['method'] == 'create_subject'
+                   for statement in entry['statements'])
+
+        plans = compile_commands("command share(s1, s2, o): enter write into (s2, o)", db)
+        assert plans['share']("admin", "user1", "file1")[0] is True
+        assert db.stats()['methods']['run_command']['calls'] == 1
+
+        db.disable_stats()
+        assert 'check' not in db.__dict__
+        db.check("user1", "file1", "read")
+        assert db.stats()['methods']['check']['calls'] == 1
+        print("✓ test_stats_collects_calls_and_slow_log - УСПЕХ")
+
+    def test_console_statistics_menu(self, console):
+        with patch('builtins.input', side_effect=['6', '4', '1', '1', '4', '6', '5']):
+            with patch('builtins.print') as mock_print:
+                console.run()
+                output = "\n".join(str(call) for call in mock_print.call_args_list)
+        assert "Сбор статистики включён" in output
+        assert "search_subjects" in output
+        print("✓ test_console_statistics_menu - УСПЕХ")
+
+
+class TestSnapshot:
+    def test_memory_snapshot_after_failure_and_in_transaction(self):
+        db = HRUDatabase(':memory:')
+        db.create_subject("admin")
+        assert db.create_subject("admin")[0] is False
+        assert db.create_object("file1", "admin")[0] is True
+        assert db.create_object("file1", "admin")[0] is False
+        assert db.conn.in_transaction is False
+        with db.snapshot() as snapshot:
+            assert snapshot.get_objects() == ["file1"]
+
+        with db.transaction():
+            db.create_subject("user1")
+            with pytest.raises(RuntimeError):
+                db.snapshot()
+        assert "user1" in db.get_subjects()
+        db.close()
+        print("✓ test_memory_snapshot_after_failure_and_in_transaction - УСПЕХ")
+
+    def test_snapshot_pins_state(self, db):
+        db.create_subject("user1")
+        with db.snapshot() as snapshot:
+            db.grant_right("admin", "user1", "file1", "read")
+            db.create_object("file2", "user1")
+
+            assert db.check("user1", "file1", "read")
+            assert not snapshot.check("user1", "file1", "read")
+            assert snapshot.get_objects() == ["file1"]
+            assert [row['subject'] for row in snapshot.iter_rights(object_name="file1")] == ["admin"]
+            with pytest.raises(sqlite3.OperationalError):
+                snapshot.grant_right("admin", "user1", "file1", "write")
+        print("✓ test_snapshot_pins_state - УСПЕХ")
+
+    def test_file_snapshot_with_concurrent_writer(self, tmp_path):
+        db = HRUDatabase(str(tmp_path / 'hru.db'))
+        db.create_subject("admin")
+        db.create_object("file1", "admin")
+        snapshot = db.snapshot()
+        db.create_subject("user1")
+        db.grant_right("admin", "user1", "file1", ["read", "write"])
+
+        assert snapshot.get_subjects() == ["admin"]
+        assert snapshot.get_rights("user1", "file1") is None
+        assert db.get_rights("user1", "file1")['write'] is True
+        snapshot.close()
+        with db.snapshot() as latest:
+            assert latest.get_subjects() == ["admin", "user1"]
+        db.close()
+        print("✓ test_file_snapshot_with_concurrent_writer - УСПЕХ")
+
+
+class TestGroupCommit:
+    def test_operations_share_one_commit(self, tmp_path):
+        db = HRUDatabase(str(tmp_path / 'hru.db'))
+        db.create_subject("admin")
+        db.create_object("file1", "admin")
+        statements = []
+        db.conn.set_trace_callback(statements.append)
+
+        with GroupCommitWriter(db, window=0.05, durability='normal') as writer:
+            created = [writer.create_subject(f"user{i}") for i in range(50)]
+            granted = [writer.grant_right("admin", f"user{i}", "file1", "read") for i in range(50)]
+            assert all(future.result()[0] for future in created + granted)
+            # Точки сохранения операций вложены в транзакцию группы:
+            # на группу ровно один BEGIN и один COMMIT
+            commits = [statement for statement in statements if statement == 'COMMIT']
+            assert writer.batches == len(commits) < 10
+            assert statements.count('BEGIN') == len(commits)
+            assert db.conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+
+        assert db.check("user49", "file1", "read")
+        assert db.conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+        with pytest.raises(RuntimeError):
+            writer.create_subject("late")
+        db.close()
+        print("✓ test_operations_share_one_commit - УСПЕХ")
+
+    def test_failed_operation_is_isolated(self, db):
+        with GroupCommitWriter(db, window=0.05) as writer:
+            before = writer.create_subject("user1")
+            broken = writer.grant_right("admin")
+            after = writer.grant_right("admin", "user1", "file1", "write")
+
+            assert isinstance(broken.exception(), TypeError)
+            assert before.result()[0] and after.result()[0]
+        assert db.get_rights("user1", "file1")['write'] is True
+        print("✓ test_failed_operation_is_isolated - УСПЕХ")
+
+
+class TestScript:
+    def test_run_script_in_batches(self, db):
+        script = [
+            "# пользователи",
+            "create_subject user1",
+            "create_subject user2",
+            "create_subject user1",
+            "grant_right admin user1 file1 read,write",
+            "",
+            "revoke_right admin user1 file1 write",
+            "unknown_command x",
+            "create_object 'quarterly report' user2",
+        ]
+        summary = run_script(db, script, batch_size=2)
+        assert (summary['total'], summary['succeeded'], summary['failed']) == (7, 5, 2)
+        assert [number for number, _ in summary['errors']] == [4, 8]
+        assert db.get_rights("user1", "file1") == {'read': True, 'write': False, 'own': False}
+        assert "quarterly report" in db.get_objects()
+
+        summary = run_script(db, ["create_subject user3", "create_subject user3"], atomic=True)
+        assert summary['failed'] == 2
+        assert "user3" not in db.get_subjects()
+        print("✓ test_run_script_in_batches - УСПЕХ")
+
+    def test_wrong_argument_count_is_reported(self, db):
+        script = [
+            "create_subject alice",
+            "grant_right alice bob",
+            "create_subject",
+            "create_object doc alice",
+        ]
+        summary = run_script(db, script, atomic=True)
+        assert (summary['total'], summary['succeeded'], summary['failed']) == (4, 2, 2)
+        assert [number for number, _ in summary['errors']] == [2, 3]
+        assert "ожидает аргументов: 4" in summary['errors'][0][1]
+        assert db.get_rights("alice", "doc")['own'] is True
+        print("✓ test_wrong_argument_count_is_reported - УСПЕХ")
+
+    def test_main_opens_console_on_db(self, tmp_path):
+        path = str(tmp_path / 'hru.db')
+        with patch('builtins.input', side_effect=['1', '1', 'user1', '4', '5']):
+            with patch('builtins.print'):
+                main(['--db', path])
+        db = HRUDatabase(path)
+        assert db.get_subjects() == ["user1"]
+        db.close()
+        print("✓ test_main_opens_console_on_db - УСПЕХ")
+
+
 class TestHRUConsole:
     def test_subject_creation_flow(self, console):
         # Эмулируем ввод: 1-1-"test_user"-4-5
@@ -95,6 +1103,22 @@ class TestHRUConsole:
             assert "new_file" in console.db.get_objects()
             print("✓ test_object_creation_flow - УСПЕХ")
 
+    def test_paged_subject_picker(self, console):
+        console.db.apply([('create_subject', f'user{i:02d}') for i in range(30)])
+        console.db.create_subject("zed")
+        console.db.grant_right("admin", "user23", "file1", "read")
+        console.db.create_object("file2", "zed")
+
+        # Вторая страница, номер 25; затем поиск по началу имени и выбор
+        with patch('builtins.input', side_effect=['4', '1', '', '25', '1', 'ze', '1', '4', '5']):
+            with patch('builtins.print') as mock_print:
+                console.run()
+                output = "\n".join(str(call) for call in mock_print.call_args_list)
+        assert "21. user19" in output
+        assert "Все права субъекта user23" in output
+        assert "Все права субъекта zed" in output
+        print("✓ test_paged_subject_picker - УСПЕХ")
+
     def test_right_grant_flow(self, console):
         # Подготовка тестовых данных
         console.db.create_subject("user1")